@@ -3,24 +3,30 @@ from pathlib import Path
 import click
 
 from envsync.core.config import ConfigService, DEFAULT_CONFIG_PATH
-from envsync.core.diff import DiffService
-from envsync.core.sync import SyncService
-from envsync.core.safe_sync import SafeSyncService
-from envsync.core.scanner import ProjectScanner
-from envsync.core.deps import DependencyService
-from envsync.core.deploy import DeployService
-from envsync.core.init import InitService
-from envsync.utils.envs import EnvContext
-from envsync.utils.git import GitRepo
 from envsync.utils.logger import get_logger
 
+# 各子命令所需服务在命令体内按需导入，避免 --help 等轻量调用加载全部模块
+
 log = get_logger(__name__)
 
 
 @click.group()
-def cli():
+@click.pass_context
+def cli(ctx):
     """EnvSync 环境同步管理 CLI"""
-    pass
+    ctx.ensure_object(dict)
+    ctx.obj.setdefault("config_service", ConfigService())
+
+
+def _config_service(ctx: click.Context) -> ConfigService:
+    return ctx.obj["config_service"]
+
+
+def get_config(ctx: click.Context):
+    """当前进程共享的 ConfigData，首次访问时加载"""
+    if ctx.obj.get("config") is None:
+        ctx.obj["config"] = _config_service(ctx).load()
+    return ctx.obj["config"]
 
 
 @cli.command()
@@ -44,10 +50,11 @@ def config():
 @click.option("--host", required=False, help="主机名或IP，local native 模式可为空")
 @click.option("--path", "env_path", required=True, help="代码目录绝对路径")
 @click.option("--user", required=False, help="SSH 用户名")
-def config_set_env(env_name, env_type, host, env_path, user):
+@click.pass_context
+def config_set_env(ctx, env_name, env_type, host, env_path, user):
     """设置环境信息"""
-    service = ConfigService()
-    cfg = service.load()
+    service = _config_service(ctx)
+    cfg = get_config(ctx)
     cfg.set_env(env_name, env_type, host, env_path, user)
     service.save(cfg)
     click.echo(f"环境 {env_name} 已更新")
@@ -57,28 +64,29 @@ def config_set_env(env_name, env_type, host, env_path, user):
 @click.option("--url", required=True)
 @click.option("--token", required=True, help="访问令牌，会以本地加密方式存储")
 @click.option("--project", "project_path", required=False, help="GitLab 项目路径，如 group/repo")
-def config_set_gitlab(url, token, project_path):
+@click.pass_context
+def config_set_gitlab(ctx, url, token, project_path):
     """设置 GitLab 信息"""
-    service = ConfigService()
-    cfg = service.load()
+    service = _config_service(ctx)
+    cfg = get_config(ctx)
     cfg.set_gitlab(url, token, project_path)
     service.save(cfg)
     click.echo("GitLab 信息已更新")
 
 
 @config.command("list")
-def config_list():
+@click.pass_context
+def config_list(ctx):
     """列出配置"""
-    service = ConfigService()
-    cfg = service.load()
+    cfg = get_config(ctx)
     click.echo(cfg.pretty())
 
 
 @config.command("validate")
-def config_validate():
+@click.pass_context
+def config_validate(ctx):
     """验证配置"""
-    service = ConfigService()
-    cfg = service.load()
+    cfg = get_config(ctx)
     issues = cfg.validate()
     if issues:
         click.echo("配置存在问题:")
@@ -89,39 +97,58 @@ def config_validate():
 
 
 @cli.command()
-def status():
+@click.pass_context
+def status(ctx):
     """查看所有环境的 Git 状态"""
-    config = ConfigService().load()
+    from concurrent.futures import ThreadPoolExecutor
+
+    from envsync.utils.envs import EnvContext
+    from envsync.utils.git import GitRepo
+
+    config = get_config(ctx)
+
+    def fetch(name, entry):
+        env_ctx = EnvContext(name, entry)
+        try:
+            return env_ctx, GitRepo(env_ctx).status(), None
+        except Exception as e:
+            return env_ctx, None, e
+
+    # 各环境 git status 相互独立且以 SSH 往返为主，并发查询
+    with ThreadPoolExecutor(max_workers=max(1, min(32, len(config.envs)))) as ex:
+        futures = {name: ex.submit(fetch, name, entry) for name, entry in config.envs.items()}
+
     click.echo("=" * 60)
     click.echo("环境状态概览")
     click.echo("=" * 60)
-    for name, entry in config.envs.items():
-        ctx = EnvContext(name, entry)
-        try:
-            repo = GitRepo(ctx)
-            st = repo.status()
-            click.echo(f"\n[{name}] {ctx.display}")
-            for line in st.summary_lines():
-                click.echo(f"  {line}")
-            if st.dirty:
-                click.echo(f"  ⚠ 工作区有未提交变更:")
-                for status_line in st.short_status[:5]:
-                    click.echo(f"    {status_line}")
-                if len(st.short_status) > 5:
-                    click.echo(f"    ... 还有 {len(st.short_status) - 5} 个文件")
-        except Exception as e:
-            click.echo(f"\n[{name}] {ctx.display}")
-            click.echo(f"  ✗ 错误: {e}", err=True)
+    for name, future in futures.items():
+        env_ctx, st, err = future.result()
+        click.echo(f"\n[{name}] {env_ctx.display}")
+        if err is not None:
+            click.echo(f"  ✗ 错误: {err}", err=True)
+            continue
+        for line in st.summary_lines():
+            click.echo(f"  {line}")
+        if st.dirty:
+            click.echo(f"  ⚠ 工作区有未提交变更:")
+            for status_line in st.short_status[:5]:
+                click.echo(f"    {status_line}")
+            if len(st.short_status) > 5:
+                click.echo(f"    ... 还有 {len(st.short_status) - 5} 个文件")
     click.echo("\n" + "=" * 60)
 
 
 @cli.command()
 @click.argument("env1")
 @click.argument("env2")
-def diff(env1, env2):
+@click.option("--deep", is_flag=True, help="使用 checksum 逐文件校验内容（较慢）")
+@click.pass_context
+def diff(ctx, env1, env2, deep):
     """对比两个环境的代码差异"""
-    service = DiffService(ConfigService().load())
-    report = service.compare(env1, env2)
+    from envsync.core.diff import DiffService
+
+    service = DiffService(get_config(ctx))
+    report = service.compare(env1, env2, deep=deep)
     click.echo(report.summary())
     if report.has_diff:
         click.echo("\n详细差异报告已生成到: ")
@@ -132,9 +159,12 @@ def diff(env1, env2):
 @click.option("--base", default="local", help="基准环境，默认为 local")
 @click.option("--branch", default="main", help="Git 分支，默认为 main")
 @click.confirmation_option(prompt="此操作将初始化所有环境到一致状态，是否继续？")
-def init_all(base, branch):
+@click.pass_context
+def init_all(ctx, base, branch):
     """一键初始化所有环境到一致状态"""
-    service = InitService(ConfigService().load())
+    from envsync.core.init import InitService
+
+    service = InitService(get_config(ctx))
     service.init_all(base_env=base, branch=branch)
     click.echo(f"\n✓ 所有环境已初始化完成，基准: {base}, 分支: {branch}")
 
@@ -148,14 +178,17 @@ def init_all(base, branch):
 @click.option("--auto-commit", is_flag=True, help="同步后自动 Git 提交")
 @click.option("--code-only", is_flag=True, help="仅同步代码（自动排除依赖/构建产物）")
 @click.option("--component", "components", multiple=True, help="指定同步的组件类型（python/node/go等）")
-def sync(source, target, strategy, backup, verify, auto_commit, code_only, components):
+@click.pass_context
+def sync(ctx, source, target, strategy, backup, verify, auto_commit, code_only, components):
     """同步代码（支持备份、校验、自动提交）"""
+    from envsync.core.safe_sync import SafeSyncService
+
     if strategy == "force":
         click.confirm(
             f"强制同步将覆盖 {target} 的所有变更，确认继续？",
             abort=True,
         )
-    service = SafeSyncService(ConfigService().load())
+    service = SafeSyncService(get_config(ctx))
     result = service.sync(
         source, target,
         strategy=strategy,
@@ -180,8 +213,11 @@ def deps():
 
 @deps.command("download")
 @click.argument("env")
-def deps_download(env):
-    service = DependencyService(ConfigService().load())
+@click.pass_context
+def deps_download(ctx, env):
+    from envsync.core.deps import DependencyService
+
+    service = DependencyService(get_config(ctx))
     path = service.download(env)
     click.echo(f"依赖已缓存到: {path}")
 
@@ -189,8 +225,11 @@ def deps_download(env):
 @deps.command("transfer")
 @click.argument("source")
 @click.argument("target")
-def deps_transfer(source, target):
-    service = DependencyService(ConfigService().load())
+@click.pass_context
+def deps_transfer(ctx, source, target):
+    from envsync.core.deps import DependencyService
+
+    service = DependencyService(get_config(ctx))
     path = service.transfer(source, target)
     click.echo(f"依赖已从 {source} 传输到 {target}: {path}")
 
@@ -198,18 +237,24 @@ def deps_transfer(source, target):
 @deps.command("install")
 @click.argument("env")
 @click.option("--cache/--no-cache", default=True, help="是否使用本地缓存")
-def deps_install(env, cache):
+@click.pass_context
+def deps_install(ctx, env, cache):
     """在指定环境安装依赖"""
-    service = DependencyService(ConfigService().load())
+    from envsync.core.deps import DependencyService
+
+    service = DependencyService(get_config(ctx))
     service.install(env, use_cache=cache)
     click.echo(f"{env} 依赖安装完成")
 
 
 @cli.command()
 @click.argument("env")
-def deploy(env):
+@click.pass_context
+def deploy(ctx, env):
     """部署到指定环境"""
-    service = DeployService(ConfigService().load())
+    from envsync.core.deploy import DeployService
+
+    service = DeployService(get_config(ctx))
     service.deploy(env)
     click.echo(f"{env} 部署完成")
 
@@ -217,13 +262,16 @@ def deploy(env):
 @cli.command()
 @click.argument("target")
 @click.option("--checkpoint", default=None, help="指定检查点时间戳，默认最近一个")
-def rollback(target, checkpoint):
+@click.pass_context
+def rollback(ctx, target, checkpoint):
     """回滚到检查点"""
+    from envsync.core.safe_sync import SafeSyncService
+
     click.confirm(
         f"将回滚 {target} 到检查点 {checkpoint or '最近'}，确认继续？",
         abort=True,
     )
-    service = SafeSyncService(ConfigService().load())
+    service = SafeSyncService(get_config(ctx))
     success = service.rollback(target, checkpoint)
     if success:
         click.echo(f"✓ {target} 已回滚")
@@ -234,9 +282,12 @@ def rollback(target, checkpoint):
 
 @cli.command("checkpoints")
 @click.argument("env")
-def list_checkpoints(env):
+@click.pass_context
+def list_checkpoints(ctx, env):
     """列出环境的所有检查点"""
-    service = SafeSyncService(ConfigService().load())
+    from envsync.core.safe_sync import SafeSyncService
+
+    service = SafeSyncService(get_config(ctx))
     checkpoints = service.list_checkpoints(env)
     if not checkpoints:
         click.echo(f"{env} 没有检查点")
@@ -251,9 +302,12 @@ def list_checkpoints(env):
 @cli.command("cleanup")
 @click.argument("env")
 @click.option("--keep", default=5, help="保留最近 N 个检查点")
-def cleanup_checkpoints(env, keep):
+@click.pass_context
+def cleanup_checkpoints(ctx, env, keep):
     """清理旧检查点"""
-    service = SafeSyncService(ConfigService().load())
+    from envsync.core.safe_sync import SafeSyncService
+
+    service = SafeSyncService(get_config(ctx))
     service.cleanup_checkpoints(env, keep=keep)
     click.echo(f"已清理 {env} 的旧检查点，保留最近 {keep} 个")
 
@@ -261,9 +315,12 @@ def cleanup_checkpoints(env, keep):
 @cli.command()
 @click.argument("env")
 @click.option("--force", is_flag=True, help="强制重新扫描（忽略缓存）")
-def scan(env, force):
+@click.pass_context
+def scan(ctx, env, force):
     """扫描环境的项目结构（识别代码/非代码）"""
-    scanner = ProjectScanner(ConfigService().load())
+    from envsync.core.scanner import ProjectScanner
+
+    scanner = ProjectScanner(get_config(ctx))
     structure = scanner.scan(env, force=force)
     click.echo(structure.summary())
 
@@ -271,9 +328,12 @@ def scan(env, force):
 @cli.command("compare-structure")
 @click.argument("env1")
 @click.argument("env2")
-def compare_structure(env1, env2):
+@click.pass_context
+def compare_structure(ctx, env1, env2):
     """比较两个环境的项目结构差异"""
-    scanner = ProjectScanner(ConfigService().load())
+    from envsync.core.scanner import ProjectScanner
+
+    scanner = ProjectScanner(get_config(ctx))
     result = scanner.compare_structures(env1, env2)
     
     click.echo(f"结构比较: {env1} vs {env2}")
@@ -1,35 +1,46 @@
 """
 Core services for EnvSync.
+
+导出项按需加载（PEP 562），``from envsync.core import X`` 只导入 X 所在模块。
 """
-from envsync.core.config import ConfigService, ConfigData, EnvEntry, GitLabConfig
-from envsync.core.diff import DiffService, DiffReport
-from envsync.core.sync import SyncService
-from envsync.core.safe_sync import SafeSyncService, SyncCheckpoint, SyncResult
-from envsync.core.scanner import ProjectScanner, ProjectStructure, ProjectComponent
-from envsync.core.deps import DependencyService
-from envsync.core.deploy import DeployService
-from envsync.core.init import InitService
-from envsync.core.adapter import AdapterService
-from envsync.core.rsync_config import RSYNC_EXCLUDES, build_rsync_args
-
-__all__ = [
-    "ConfigService",
-    "ConfigData",
-    "EnvEntry",
-    "GitLabConfig",
-    "DiffService",
-    "DiffReport",
-    "SyncService",
-    "SafeSyncService",
-    "SyncCheckpoint",
-    "SyncResult",
-    "ProjectScanner",
-    "ProjectStructure",
-    "ProjectComponent",
-    "DependencyService",
-    "DeployService",
-    "InitService",
-    "AdapterService",
-    "RSYNC_EXCLUDES",
-    "build_rsync_args",
-]
+from __future__ import annotations
+
+import importlib
+from typing import Any
+
+_EXPORTS = {
+    "ConfigService": "envsync.core.config",
+    "ConfigData": "envsync.core.config",
+    "EnvEntry": "envsync.core.config",
+    "GitLabConfig": "envsync.core.config",
+    "DiffService": "envsync.core.diff",
+    "DiffReport": "envsync.core.diff",
+    "SyncService": "envsync.core.sync",
+    "SafeSyncService": "envsync.core.safe_sync",
+    "SyncCheckpoint": "envsync.core.safe_sync",
+    "SyncResult": "envsync.core.safe_sync",
+    "ProjectScanner": "envsync.core.scanner",
+    "ProjectStructure": "envsync.core.scanner",
+    "ProjectComponent": "envsync.core.scanner",
+    "DependencyService": "envsync.core.deps",
+    "DeployService": "envsync.core.deploy",
+    "InitService": "envsync.core.init",
+    "AdapterService": "envsync.core.adapter",
+    "RSYNC_EXCLUDES": "envsync.core.rsync_config",
+    "build_rsync_args": "envsync.core.rsync_config",
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name: str) -> Any:
+    module_name = _EXPORTS.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module_name), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
@@ -1,15 +1,34 @@
 from __future__ import annotations
 
+import functools
+import os
 from pathlib import Path
 from typing import Dict, Optional, Any
 
-from jinja2 import Environment, FileSystemLoader
+from jinja2 import Environment, FileSystemLoader, Template
 
 from envsync.core.config import ConfigData, EnvEntry
 from envsync.utils.logger import get_logger
 
 log = get_logger(__name__)
 
+# 按模板目录复用 Jinja Environment
+_ENV_CACHE: Dict[str, Environment] = {}
+
+
+def _get_env(env_dir: str) -> Environment:
+    jinja_env = _ENV_CACHE.get(env_dir)
+    if jinja_env is None:
+        jinja_env = Environment(loader=FileSystemLoader(env_dir), autoescape=False, cache_size=400)
+        _ENV_CACHE[env_dir] = jinja_env
+    return jinja_env
+
+
+@functools.lru_cache(maxsize=128)
+def _get_template(env_dir: str, name: str, mtime_ns: int) -> Template:
+    """编译后的模板，mtime_ns 作为失效键：模板文件修改后重新编译"""
+    return _get_env(env_dir).get_template(name)
+
 
 class AdapterService:
     """
@@ -26,8 +45,7 @@ class AdapterService:
         out_path = Path(output_path) if output_path else tpl_path.with_suffix("")
         out_path.parent.mkdir(parents=True, exist_ok=True)
 
-        jinja_env = Environment(loader=FileSystemLoader(str(tpl_path.parent)), autoescape=False)
-        template = jinja_env.get_template(tpl_path.name)
+        template = _get_template(str(tpl_path.parent), tpl_path.name, tpl_path.stat().st_mtime_ns)
         context = {
             "env_name": env,
             "env": ctx_entry.to_dict(),
@@ -39,8 +57,15 @@ class AdapterService:
         if extra:
             context.update(extra)
 
-        rendered = template.render(**context)
-        out_path.write_text(rendered, encoding="utf-8")
+        # 分块写入临时文件后原子替换，避免整份渲染结果驻留内存及半写文件
+        tmp_path = out_path.with_name(out_path.name + ".tmp")
+        try:
+            with open(tmp_path, "wb") as f:
+                template.stream(**context).dump(f, encoding="utf-8")
+            os.replace(tmp_path, out_path)
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
         log.info("模板渲染完成: %s -> %s", tpl_path, out_path)
         return out_path
 
@@ -1,18 +1,53 @@
 from __future__ import annotations
 
+import copy
+import functools
+import heapq
 import json
 import os
+import shutil
+import stat
+import tempfile
+import time
 from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Dict, Optional, List, Any
+from typing import Dict, Optional, List, Any, Tuple
 
 import yaml
 
 from envsync.utils.crypto import SecretManager
 
+# 优先使用 libyaml C 实现，未编译时回退纯 Python 版本
+try:
+    from yaml import CSafeLoader as _Loader, CSafeDumper as _Dumper
+except ImportError:  # pragma: no cover - 取决于 PyYAML 编译方式
+    from yaml import SafeLoader as _Loader, SafeDumper as _Dumper
+
 DEFAULT_CONFIG_DIR = Path.home() / ".envsync"
 DEFAULT_CONFIG_PATH = DEFAULT_CONFIG_DIR / "config.yaml"
 
+# 保留的配置备份数量
+CONFIG_BACKUP_KEEP = 10
+
+# 已解析配置缓存：path -> (st_mtime_ns, st_size, ConfigData)，文件未变更时跳过 YAML 解析
+_CONFIG_CACHE: Dict[Path, Tuple[int, int, "ConfigData"]] = {}
+
+
+@functools.lru_cache(maxsize=1)
+def _secret_mgr() -> SecretManager:
+    """进程内共享的 SecretManager"""
+    return SecretManager()
+
+
+@functools.lru_cache(maxsize=64)
+def _decrypt(token: str) -> str:
+    return _secret_mgr().decrypt(token)
+
+
+# EnvEntry 显式字段，其余键归入 extras
+_NON_EXTRAS = frozenset({"type", "path", "host", "user"})
+_VALID_TYPES = frozenset({"docker", "native"})
+
 
 @dataclass
 class EnvEntry:
@@ -25,12 +60,15 @@ class EnvEntry:
 
     def validate(self) -> List[str]:
         issues: List[str] = []
-        if self.type not in ("docker", "native"):
+        if self.type not in _VALID_TYPES:
             issues.append(f"{self.name}: type 必须为 docker 或 native")
         if not self.path:
             issues.append(f"{self.name}: path 不能为空")
         return issues
 
+    def is_valid(self) -> bool:
+        return self.type in _VALID_TYPES and bool(self.path)
+
     def to_dict(self) -> Dict[str, Any]:
         data = {
             "type": self.type,
@@ -52,17 +90,7 @@ class EnvEntry:
             path=data.get("path", ""),
             host=data.get("host"),
             user=data.get("user"),
-            extras={
-                k: v
-                for k, v in data.items()
-                if k
-                not in {
-                    "type",
-                    "path",
-                    "host",
-                    "user",
-                }
-            },
+            extras={k: v for k, v in data.items() if k not in _NON_EXTRAS},
         )
 
 
@@ -81,12 +109,14 @@ class GitLabConfig:
             issues.append("gitlab.token 不能为空")
         return issues
 
+    def is_valid(self) -> bool:
+        return bool(self.url) and bool(self.token)
+
     def to_dict(self, encrypt: bool = True) -> Dict[str, Any]:
         """序列化，支持加密 token"""
         token_value = self.token
         if encrypt and not self._encrypted:
-            secret_mgr = SecretManager()
-            token_value = secret_mgr.encrypt(self.token)
+            token_value = _secret_mgr().encrypt(self.token)
         data = {"url": self.url, "token": token_value}
         if self.project:
             data["project"] = self.project
@@ -95,11 +125,11 @@ class GitLabConfig:
     @classmethod
     def from_dict(cls, data: Dict[str, Any]) -> "GitLabConfig":
         token = data.get("token", "")
-        secret_mgr = SecretManager()
-        # 自动检测并解密
-        is_encrypted = secret_mgr.is_encrypted(token)
+        # 自动检测并解密（兼容旧版本无前缀标记的密文）
+        mgr = _secret_mgr()
+        is_encrypted = mgr.is_encrypted(token) or mgr.is_encrypted_legacy(token)
         if is_encrypted:
-            token = secret_mgr.decrypt(token)
+            token = _decrypt(token)
         return cls(
             url=data.get("url", ""),
             token=token,
@@ -146,6 +176,12 @@ class ConfigData:
             issues.append("未配置 GitLab 信息")
         return issues
 
+    def is_valid(self) -> bool:
+        """仅判断是否有效，遇到首个问题即返回，不收集问题明细"""
+        if not self.envs or self.gitlab is None:
+            return False
+        return all(env.is_valid() for env in self.envs.values()) and self.gitlab.is_valid()
+
     def to_dict(self, encrypt: bool = True) -> Dict[str, Any]:
         data: Dict[str, Any] = {
             "environments": {name: env.to_dict() for name, env in self.envs.items()},
@@ -163,7 +199,45 @@ class ConfigData:
         return cls(envs=envs, gitlab=gitlab)
 
     def pretty(self) -> str:
-        return yaml.safe_dump(self.to_dict(), sort_keys=False, allow_unicode=True)
+        return yaml.dump(self.to_dict(), Dumper=_Dumper, sort_keys=False, allow_unicode=True)
+
+
+def _copy_file(src: Path, dst: Path):
+    """内核态拷贝（sendfile），不支持时退回 1MB 缓冲区拷贝；不复制元数据"""
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        size = os.fstat(fsrc.fileno()).st_size
+        try:
+            offset = 0
+            while offset < size:
+                sent = os.sendfile(fdst.fileno(), fsrc.fileno(), offset, size - offset)
+                if sent == 0:
+                    break
+                offset += sent
+        except (AttributeError, OSError):
+            fsrc.seek(0)
+            fdst.seek(0)
+            fdst.truncate()
+            shutil.copyfileobj(fsrc, fdst, length=1 << 20)
+
+
+def _atomic_write(path: Path, content: str, mode: Optional[int] = None):
+    """
+    写入同目录下唯一命名的临时文件后原子替换 path，并发写入互不覆盖、读者不会看到半个文件。
+    mode 为 None 时保留 mkstemp 的 0600；失败时删除临时文件
+    """
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            if mode is not None:
+                os.fchmod(f.fileno(), mode)
+            f.write(content)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except FileNotFoundError:
+            pass
+        raise
 
 
 class ConfigService:
@@ -199,22 +273,92 @@ class ConfigService:
             },
         }
         with self.config_path.open("w", encoding="utf-8") as f:
-            yaml.safe_dump(default_content, f, sort_keys=False, allow_unicode=True)
+            yaml.dump(default_content, f, Dumper=_Dumper, sort_keys=False, allow_unicode=True)
 
     def load(self) -> ConfigData:
+        """加载配置，文件 (mtime, size) 未变化时直接返回缓存副本"""
         self.ensure_initialized()
+        st = self.config_path.stat()
+        cached = _CONFIG_CACHE.get(self.config_path)
+        if cached and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+            # 返回副本，避免调用方修改污染缓存
+            return copy.deepcopy(cached[2])
+        raw = self._load_raw(st)
+        config = ConfigData.from_dict(raw)
+        _CONFIG_CACHE[self.config_path] = (st.st_mtime_ns, st.st_size, config)
+        return copy.deepcopy(config)
+
+    @property
+    def shadow_path(self) -> Path:
+        """YAML 解析结果的 JSON 影子文件，跨进程复用"""
+        return self.config_path.with_suffix(".cache.json")
+
+    def _load_raw(self, st: os.stat_result) -> Dict[str, Any]:
+        """读取原始配置字典，影子文件与 YAML (mtime, size) 一致时跳过 YAML 解析"""
+        try:
+            shadow = json.loads(self.shadow_path.read_text(encoding="utf-8"))
+            if shadow.get("mtime_ns") == st.st_mtime_ns and shadow.get("size") == st.st_size:
+                return shadow["data"]
+        except (OSError, ValueError, KeyError, AttributeError):
+            pass
+
         with self.config_path.open("r", encoding="utf-8") as f:
-            raw = yaml.safe_load(f) or {}
-        return ConfigData.from_dict(raw)
+            raw = yaml.load(f, Loader=_Loader) or {}
+        try:
+            dumped = json.dumps(
+                {"mtime_ns": st.st_mtime_ns, "size": st.st_size, "data": raw},
+                ensure_ascii=False,
+                separators=(",", ":"),
+            )
+            # 非字符串键、元组等经 JSON 往返后会改变，此时不写影子文件，保证两种读取路径结果一致
+            if json.loads(dumped)["data"] == raw:
+                # 与 config.yaml 同权限（含主机、路径与加密 token），原子替换避免并发读到半个文件
+                _atomic_write(self.shadow_path, dumped, stat.S_IMODE(st.st_mode))
+        except (OSError, TypeError, ValueError):
+            # 含 JSON 无法表示的值（如日期）时不写影子文件
+            pass
+        return raw
 
     def save(self, config: ConfigData, encrypt: bool = True):
         """保存配置，默认加密敏感信息"""
         self.config_path.parent.mkdir(parents=True, exist_ok=True)
-        # 备份旧配置
+        content = yaml.dump(config.to_dict(encrypt=encrypt), Dumper=_Dumper, sort_keys=False, allow_unicode=True)
+        mode = None
         if self.config_path.exists():
-            import time
-            backup = self.config_path.with_suffix(f".{time.strftime('%Y%m%d-%H%M%S')}.yaml")
-            import shutil
-            shutil.copy(self.config_path, backup)
-        with self.config_path.open("w", encoding="utf-8") as f:
-            yaml.safe_dump(config.to_dict(encrypt=encrypt), f, sort_keys=False, allow_unicode=True)
+            if self.config_path.read_text(encoding="utf-8") == content:
+                return  # 内容未变化，无需备份与写入
+            # 沿用原文件权限（含 token，用户可能已收紧为 0600）
+            mode = stat.S_IMODE(self.config_path.stat().st_mode)
+            self._backup()
+        # 写入新文件后原子替换，旧 inode 由备份硬链接保留
+        _atomic_write(self.config_path, content, mode)
+        _CONFIG_CACHE.pop(self.config_path, None)
+
+    def _backup(self):
+        """备份旧配置（优先硬链接），仅保留最近 CONFIG_BACKUP_KEEP 份"""
+        backup = self.config_path.with_suffix(f".{time.strftime('%Y%m%d-%H%M%S')}.yaml")
+        try:
+            os.link(self.config_path, backup)
+        except OSError:
+            # 跨文件系统或同秒内重复备份
+            backup.unlink(missing_ok=True)
+            _copy_file(self.config_path, backup)
+        # 备份名内含时间戳，按名称即可排序；单次 scandir + 部分排序，无需逐个 stat
+        prefix, suffix = f"{self.config_path.stem}.", ".yaml"
+        with os.scandir(self.config_path.parent) as it:
+            backups = [
+                entry.path
+                for entry in it
+                if entry.name.startswith(prefix)
+                and entry.name.endswith(suffix)
+                and entry.name != self.config_path.name
+            ]
+        if len(backups) <= CONFIG_BACKUP_KEEP:
+            return
+        keep = set(heapq.nlargest(CONFIG_BACKUP_KEEP, backups))
+        for path in backups:
+            if path not in keep:
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
@@ -1,15 +1,45 @@
 from __future__ import annotations
 
+import hashlib
+import shlex
 import subprocess
+from collections import deque
 from pathlib import Path
-from typing import Optional
+from typing import Dict, List, Optional, Tuple
 
 from envsync.core.config import ConfigData
-from envsync.utils.envs import EnvContext
+from envsync.core.rsync_config import compress_args
+from envsync.utils.envs import EnvContext, context_for
 from envsync.utils.logger import get_logger
 
 log = get_logger(__name__)
 
+# 依赖清单文件，按环境一次性探测
+MANIFEST_FILES = ("requirements.txt", "package.json")
+
+# 缓存目录内记录上次成功下载时依赖清单的 sha256
+DIGEST_FILE = ".manifest.sha256"
+
+
+def _run_streamed(cmd: List[str], tail_lines: int = 200) -> Tuple[int, str]:
+    """
+    执行命令并逐行读取 stderr，仅保留末尾若干行用于报错，
+    避免大体量传输输出整体缓存在内存中。返回 (退出码, stderr 末尾)。
+    """
+    tail: deque = deque(maxlen=tail_lines)
+    with subprocess.Popen(
+        cmd,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+        bufsize=1,
+    ) as proc:
+        for line in proc.stderr:
+            tail.append(line)
+            log.debug(line.rstrip())
+        code = proc.wait()
+    return code, "".join(tail)
+
 
 class DependencyService:
     """
@@ -18,6 +48,7 @@ class DependencyService:
 
     def __init__(self, config: ConfigData):
         self.config = config
+        self._ctx_cache: Dict[str, EnvContext] = {}
         self.cache_root = Path.home() / ".envsync" / "deps-cache"
 
     def download(self, env: str) -> Path:
@@ -27,10 +58,11 @@ class DependencyService:
         cache_dir = self.cache_root / env
         cache_dir.mkdir(parents=True, exist_ok=True)
 
+        manifests = self._probe(ctx)
         # 检测 Python 项目
-        py_downloaded = self._download_python(ctx, cache_dir)
+        py_downloaded = self._download_python(ctx, cache_dir, manifests["requirements.txt"])
         # 检测 Node.js 项目
-        node_downloaded = self._download_node(ctx, cache_dir)
+        node_downloaded = self._download_node(ctx, cache_dir, manifests["package.json"])
 
         if not py_downloaded and not node_downloaded:
             log.warning("未检测到 requirements.txt 或 package.json，跳过")
@@ -58,14 +90,15 @@ class DependencyService:
         )
         cmd = [
             "rsync",
-            "-az",
+            "-a",
+            *compress_args(dst_ctx.is_remote),
             "--info=progress2",
             f"{src_cache}/",
             dst_spec,
         ]
-        proc = subprocess.run(cmd, capture_output=True, text=True)
-        if proc.returncode != 0:
-            raise RuntimeError(f"rsync 传输失败: {proc.stderr}")
+        code, err = _run_streamed(cmd)
+        if code != 0:
+            raise RuntimeError(f"rsync 传输失败: {err}")
 
         log.info("✓ 依赖已传输到 %s:%s", target, remote_cache)
         return Path(remote_cache)
@@ -77,26 +110,74 @@ class DependencyService:
 
         cache_dir = f"{ctx.entry.path}/.envsync-deps" if use_cache else None
 
+        manifests = self._probe(ctx)
         # Python
-        self._install_python(ctx, cache_dir)
+        self._install_python(ctx, manifests["requirements.txt"], cache_dir)
         # Node.js
-        self._install_node(ctx, cache_dir)
+        self._install_node(ctx, manifests["package.json"], cache_dir)
 
         log.info("✓ %s 依赖安装完成", env)
 
     def _ctx(self, env: str) -> EnvContext:
-        if env not in self.config.envs:
-            raise ValueError(f"环境未配置: {env}")
-        return EnvContext(name=env, entry=self.config.envs[env])
+        return context_for(self._ctx_cache, self.config.envs, env)
+
+    def _probe(self, ctx: EnvContext) -> Dict[str, bool]:
+        """单条命令探测所有依赖清单文件是否存在，避免每个文件一次远程往返"""
+        if not ctx.is_remote:
+            return {name: ctx.client.isfile(f"{ctx.entry.path}/{name}") for name in MANIFEST_FILES}
+        names = " ".join(MANIFEST_FILES)
+        result = ctx.client.run(
+            f"cd {shlex.quote(ctx.entry.path)} 2>/dev/null && "
+            f"for f in {names}; do [ -f \"$f\" ] && echo \"$f:1\" || echo \"$f:0\"; done"
+        )
+        found = {name: False for name in MANIFEST_FILES}
+        for line in result.stdout.splitlines():
+            name, _, flag = line.strip().rpartition(":")
+            if name in found:
+                found[name] = flag == "1"
+        return found
+
+    def _manifest_digest(self, ctx: EnvContext, name: str) -> Optional[str]:
+        """计算环境中依赖清单文件的 sha256，文件不存在时返回 None"""
+        path = f"{ctx.entry.path}/{name}"
+        if not ctx.is_remote:
+            try:
+                return hashlib.sha256(Path(path).read_bytes()).hexdigest()
+            except OSError:
+                return None
+        quoted = shlex.quote(path)
+        result = ctx.client.run(f"sha256sum {quoted} 2>/dev/null || shasum -a 256 {quoted}")
+        if result.code != 0 or not result.stdout.strip():
+            return None
+        return result.stdout.split()[0]
+
+    @staticmethod
+    def _cache_fresh(cache: Path, digest: Optional[str]) -> bool:
+        """清单未变化且缓存已存在时无需重新下载"""
+        if not digest:
+            return False
+        try:
+            return (cache / DIGEST_FILE).read_text().strip() == digest
+        except OSError:
+            return False
+
+    @staticmethod
+    def _mark_cache(cache: Path, digest: Optional[str]):
+        if digest:
+            (cache / DIGEST_FILE).write_text(digest + "\n")
 
-    def _download_python(self, ctx: EnvContext, cache_dir: Path) -> bool:
+    def _download_python(self, ctx: EnvContext, cache_dir: Path, has_requirements: bool) -> bool:
         """下载 Python 依赖到本地缓存"""
-        req_check = ctx.client.run(f"[ -f {ctx.entry.path}/requirements.txt ] && echo exists")
-        if "exists" not in req_check.stdout:
+        if not has_requirements:
             return False
 
-        log.info("  下载 Python 依赖...")
         py_cache = cache_dir / "python"
+        digest = self._manifest_digest(ctx, "requirements.txt")
+        if self._cache_fresh(py_cache, digest):
+            log.info("  requirements.txt 未变化，复用 Python 依赖缓存")
+            return True
+
+        log.info("  下载 Python 依赖...")
         py_cache.mkdir(parents=True, exist_ok=True)
 
         if ctx.is_remote:
@@ -110,13 +191,13 @@ class DependencyService:
                 return False
             # rsync 回本地
             rsync_cmd = [
-                "rsync", "-az",
+                "rsync", "-a", *compress_args(ctx.is_remote),
                 f"{ctx.entry.user + '@' if ctx.entry.user else ''}{ctx.entry.host}:{remote_cache}/",
                 f"{py_cache}/",
             ]
-            proc = subprocess.run(rsync_cmd, capture_output=True, text=True)
-            if proc.returncode != 0:
-                log.warning("  rsync 传输失败: %s", proc.stderr)
+            code, err = _run_streamed(rsync_cmd)
+            if code != 0:
+                log.warning("  rsync 传输失败: %s", err)
                 return False
         else:
             # 本地环境：直接下载到缓存目录
@@ -126,17 +207,22 @@ class DependencyService:
                 log.warning("  pip download 失败: %s", result.stderr)
                 return False
 
+        self._mark_cache(py_cache, digest)
         log.info("  ✓ Python 依赖已下载")
         return True
 
-    def _download_node(self, ctx: EnvContext, cache_dir: Path) -> bool:
+    def _download_node(self, ctx: EnvContext, cache_dir: Path, has_package: bool) -> bool:
         """下载 Node.js 依赖到本地缓存"""
-        pkg_check = ctx.client.run(f"[ -f {ctx.entry.path}/package.json ] && echo exists")
-        if "exists" not in pkg_check.stdout:
+        if not has_package:
             return False
 
-        log.info("  下载 Node.js 依赖...")
         node_cache = cache_dir / "node"
+        digest = self._manifest_digest(ctx, "package-lock.json") or self._manifest_digest(ctx, "package.json")
+        if self._cache_fresh(node_cache, digest):
+            log.info("  package.json 未变化，复用 Node.js 依赖缓存")
+            return True
+
+        log.info("  下载 Node.js 依赖...")
         node_cache.mkdir(parents=True, exist_ok=True)
 
         if ctx.is_remote:
@@ -150,13 +236,13 @@ class DependencyService:
                 return False
             # rsync 回本地
             rsync_cmd = [
-                "rsync", "-az",
+                "rsync", "-a", *compress_args(ctx.is_remote),
                 f"{ctx.entry.user + '@' if ctx.entry.user else ''}{ctx.entry.host}:{remote_cache}/",
                 f"{node_cache}/",
             ]
-            proc = subprocess.run(rsync_cmd, capture_output=True, text=True)
-            if proc.returncode != 0:
-                log.warning("  rsync 传输失败: %s", proc.stderr)
+            code, err = _run_streamed(rsync_cmd)
+            if code != 0:
+                log.warning("  rsync 传输失败: %s", err)
                 return False
         else:
             # 本地环境：直接打包到缓存目录
@@ -166,13 +252,13 @@ class DependencyService:
                 log.warning("  npm pack 失败: %s", result.stderr)
                 return False
 
+        self._mark_cache(node_cache, digest)
         log.info("  ✓ Node.js 依赖已下载")
         return True
 
-    def _install_python(self, ctx: EnvContext, cache_dir: Optional[str] = None):
+    def _install_python(self, ctx: EnvContext, has_requirements: bool, cache_dir: Optional[str] = None):
         """安装 Python 依赖"""
-        req_check = ctx.client.run(f"[ -f {ctx.entry.path}/requirements.txt ] && echo exists")
-        if "exists" not in req_check.stdout:
+        if not has_requirements:
             return
 
         log.info("  安装 Python 依赖...")
@@ -189,10 +275,9 @@ class DependencyService:
         else:
             log.info("  ✓ Python 依赖安装完成")
 
-    def _install_node(self, ctx: EnvContext, cache_dir: Optional[str] = None):
+    def _install_node(self, ctx: EnvContext, has_package: bool, cache_dir: Optional[str] = None):
         """安装 Node.js 依赖"""
-        pkg_check = ctx.client.run(f"[ -f {ctx.entry.path}/package.json ] && echo exists")
-        if "exists" not in pkg_check.stdout:
+        if not has_package:
             return
 
         log.info("  安装 Node.js 依赖...")
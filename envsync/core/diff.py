@@ -1,18 +1,21 @@
 from __future__ import annotations
 
-import subprocess
+import re
 import time
 from dataclasses import dataclass
 from pathlib import Path
-from typing import List, Optional, Tuple
+from typing import Dict, List, Optional, Tuple
 
 from envsync.core.config import ConfigData
-from envsync.core.rsync_config import build_rsync_args
-from envsync.utils.envs import EnvContext
+from envsync.core.rsync_config import RsyncStream, build_rsync_args, gitignore_filter_for
+from envsync.utils.envs import EnvContext, context_for
 from envsync.utils.logger import get_logger
 
 log = get_logger(__name__)
 
+# --out-format="%i %f" 的输出行：删除行为 "*deleting   路径"，其余为 "itemize 路径"
+_ITEM_RE = re.compile(r"^(?:\*deleting +(?P<deleted>.+)|(?P<item>\S+) (?P<path>.+))$", re.MULTILINE)
+
 
 @dataclass
 class DiffReport:
@@ -31,13 +34,15 @@ class DiffReport:
 class DiffService:
     def __init__(self, config: ConfigData):
         self.config = config
+        self._ctx_cache: Dict[str, EnvContext] = {}
 
-    def compare(self, env1: str, env2: str) -> DiffReport:
+    def compare(self, env1: str, env2: str, deep: bool = False) -> DiffReport:
         """
-        使用 rsync --dry-run --checksum --delete 生成文件级差异报告。
+        使用 rsync --dry-run --delete 生成文件级差异报告。
         - 支持本地与远程（通过 SSH）
         - 统计新增/修改/删除文件数量
         - 输出详细报告到 ~/.envsync/reports
+        - 默认按大小+修改时间快速比较；deep=True 时使用 --checksum 逐字节校验（需读取全部文件）
         """
         ctx1, ctx2 = self._build_ctx(env1), self._build_ctx(env2)
         log.info("开始生成差异报告: %s -> %s", ctx1.display, ctx2.display)
@@ -46,7 +51,7 @@ class DiffService:
         timestamp = time.strftime("%Y%m%d-%H%M%S")
         report_file = report_dir / f"diff-{env1}-vs-{env2}-{timestamp}.txt"
 
-        lines, stats = self._rsync_diff(ctx1, ctx2)
+        lines, stats = self._rsync_diff(ctx1, ctx2, deep=deep)
         has_diff = any(v > 0 for v in stats)
 
         summary_lines = [
@@ -60,44 +65,42 @@ class DiffService:
         return DiffReport(env1=env1, env2=env2, has_diff=has_diff, summary_lines=summary_lines, output_path=report_file)
 
     def _build_ctx(self, env: str) -> EnvContext:
-        if env not in self.config.envs:
-            raise ValueError(f"环境未配置: {env}")
-        return EnvContext(name=env, entry=self.config.envs[env])
+        return context_for(self._ctx_cache, self.config.envs, env)
 
-    def _rsync_diff(self, src: EnvContext, dst: EnvContext) -> Tuple[List[str], Tuple[int, int, int]]:
+    def _rsync_diff(self, src: EnvContext, dst: EnvContext, deep: bool = False) -> Tuple[List[str], Tuple[int, int, int]]:
         """
         返回 (明细行, (新增, 修改, 删除))
         """
         cmd = build_rsync_args(
             dry_run=True,
-            checksum=True,
+            checksum=deep,
             delete=True,
             itemize=True,
+            merged_filter=gitignore_filter_for(src.entry.path, src.is_local),
+            fast_checksum=src.is_local and dst.is_local,
         )
+        # 只关心内容差异，忽略权限/属主变化
+        cmd.extend(["--no-perms", "--no-owner", "--no-group"])
         cmd.append("--out-format=%i %f")
         cmd.extend([src.rsync_spec(), dst.rsync_spec()])
-        proc = subprocess.run(cmd, capture_output=True, text=True)
-        if proc.returncode not in (0, 23):  # 23 可能表示部分文件差异/缺失，仍记录
-            raise RuntimeError(f"rsync 执行失败: {proc.stderr or proc.stdout}")
-
         created = modified = deleted = 0
         detail_lines: List[str] = []
-        for ln in proc.stdout.splitlines():
-            if not ln.strip():
-                continue
-            if ln.startswith("*deleting "):
-                deleted += 1
-                detail_lines.append(f"DEL {ln[len('*deleting '):]}")
-                continue
-            item, _, path = ln.partition(" ")
-            if not path:
-                continue
-            if "+++++++++" in item:
-                created += 1
-                detail_lines.append(f"ADD {path}")
-            else:
-                modified += 1
-                detail_lines.append(f"MOD {path}")
+        with RsyncStream(cmd) as stream:
+            for block in stream.blocks():
+                for m in _ITEM_RE.finditer(block):
+                    path = m.group("deleted")
+                    if path is not None:
+                        deleted += 1
+                        detail_lines.append(f"DEL {path}")
+                    elif "+++++++++" in m.group("item"):
+                        created += 1
+                        detail_lines.append(f"ADD {m.group('path')}")
+                    else:
+                        modified += 1
+                        detail_lines.append(f"MOD {m.group('path')}")
+            code = stream.wait()
+            if code not in (0, 23):  # 23 可能表示部分文件差异/缺失，仍记录
+                raise RuntimeError(f"rsync 执行失败: {stream.stderr() or f'exit {code}'}")
 
         summary_header = f"rsync dry-run diff {src.display} -> {dst.display}"
         detail_lines.insert(0, summary_header)
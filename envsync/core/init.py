@@ -1,9 +1,11 @@
 from __future__ import annotations
 
-from typing import Optional
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, Optional
 
 from envsync.core.config import ConfigData
-from envsync.utils.envs import EnvContext
+from envsync.utils.envs import EnvContext, context_for
 from envsync.utils.git import GitRepo
 from envsync.utils.logger import get_logger
 
@@ -23,6 +25,8 @@ class InitService:
 
     def __init__(self, config: ConfigData):
         self.config = config
+        self._ctx_cache: Dict[str, EnvContext] = {}
+        self._repo_cache: Dict[str, GitRepo] = {}
 
     def init_all(self, base_env: str = "local", branch: str = "main"):
         """
@@ -47,12 +51,12 @@ class InitService:
         log.info("步骤 4/6: 推送基准代码到 GitLab...")
         self._push_base(base_repo, branch)
 
-        # 5. 其他环境从 GitLab 拉取
+        # 5. 其他环境从 GitLab 拉取（基准推送完成后并发执行）
         log.info("步骤 5/6: 同步其他环境...")
-        for env_name in self.config.envs.keys():
-            if env_name == base_env:
-                continue
-            self._sync_env(env_name, branch)
+        self._for_each_env(
+            lambda env_name: self._sync_env(env_name, branch),
+            (name for name in self.config.envs if name != base_env),
+        )
 
         # 6. 验证一致性
         log.info("步骤 6/6: 验证环境一致性...")
@@ -61,18 +65,43 @@ class InitService:
         log.info("✓ 所有环境初始化完成")
 
     def _ctx(self, env: str) -> EnvContext:
-        if env not in self.config.envs:
-            raise ValueError(f"环境未配置: {env}")
-        return EnvContext(name=env, entry=self.config.envs[env])
+        return context_for(self._ctx_cache, self.config.envs, env)
+
+    def _repo(self, ctx: EnvContext) -> GitRepo:
+        repo = self._repo_cache.get(ctx.name)
+        if repo is None:
+            repo = self._repo_cache[ctx.name] = GitRepo(ctx)
+        return repo
+
+    def _for_each_env(self, fn: Callable[[str], Any], env_names: Iterable[str]) -> Dict[str, Any]:
+        """
+        并发对各环境执行 fn（各环境操作互不依赖，耗时以 SSH 往返为主），
+        按输入顺序返回 {环境名: 结果}；任一环境失败时汇总所有错误后抛出
+        """
+        names = list(env_names)
+        if not names:
+            return {}
+        with ThreadPoolExecutor(max_workers=len(names)) as ex:
+            futures = {name: ex.submit(fn, name) for name in names}
+        results: Dict[str, Any] = {}
+        errors = []
+        for name, future in futures.items():
+            try:
+                results[name] = future.result()
+            except Exception as e:
+                errors.append(str(e))
+        if errors:
+            raise RuntimeError("\n".join(errors))
+        return results
 
     def _validate_environments(self):
         """验证所有环境可连接"""
-        issues = self.config.validate()
-        if issues:
+        if not self.config.is_valid():
+            issues = self.config.validate()
             raise RuntimeError(f"配置验证失败:\n" + "\n".join(f"  - {i}" for i in issues))
 
-        for env_name, entry in self.config.envs.items():
-            ctx = EnvContext(name=env_name, entry=entry)
+        def check(env_name: str):
+            ctx = self._ctx(env_name)
             try:
                 # 简单的连通性测试
                 result = ctx.client.run("echo 'connectivity test'")
@@ -82,10 +111,12 @@ class InitService:
             except Exception as e:
                 raise RuntimeError(f"环境 {env_name} 连接失败: {e}")
 
+        self._for_each_env(check, self.config.envs)
+
     def _ensure_git_repo(self, ctx: EnvContext) -> GitRepo:
         """确保环境是 Git 仓库，如不是则初始化"""
+        repo = self._repo(ctx)
         try:
-            repo = GitRepo(ctx)
             repo.ensure_repo()
             log.info("  ✓ %s 已是 Git 仓库", ctx.name)
             return repo
@@ -97,7 +128,7 @@ class InitService:
                 'git commit -m "Initial commit by envsync"',
                 cwd=ctx.entry.path,
             ).check_ok("git commit")
-            repo = GitRepo(ctx)
+            repo.invalidate()
             log.info("  ✓ %s Git 仓库初始化完成", ctx.name)
             return repo
 
@@ -143,7 +174,7 @@ class InitService:
 
         try:
             # 尝试作为现有仓库拉取
-            repo = GitRepo(ctx)
+            repo = self._repo(ctx)
             repo.ensure_repo()
             self._ensure_remote(repo, ctx)
             repo.fetch()
@@ -155,26 +186,36 @@ class InitService:
             log.info("  ! %s 非 Git 仓库，尝试 clone...", env)
             try:
                 git_url = f"{self.config.gitlab.url}/{self.config.gitlab.project}.git"
-                # 备份原目录（如果有内容）
-                backup_cmd = f"[ -d {ctx.entry.path} ] && mv {ctx.entry.path} {ctx.entry.path}.bak-$(date +%s) || true"
-                ctx.client.run(backup_cmd)
-                # Clone
-                parent = str(ctx.entry.path).rsplit("/", 1)[0]
-                clone_cmd = f"git clone -b {branch} {git_url} {ctx.entry.path}"
+                path = str(ctx.entry.path)
+                # 备份原目录（如果存在）；参数列表形式执行，路径不经 shell 解释
+                if ctx.client.run(["test", "-d", path]).code == 0:
+                    ctx.client.run(["mv", path, f"{path}.bak-{int(time.time())}"]).check_ok("备份原目录")
+                # 部分克隆：完整提交历史与所有远端分支（回滚到旧检查点、切换分支需要），
+                # 文件内容按需下载；服务端不支持过滤时 git 自动退回完整克隆
+                parent = path.rsplit("/", 1)[0]
+                clone_cmd = [
+                    "git", "-c", "protocol.version=2", "clone",
+                    "--filter=blob:none", "-b", branch, git_url, path,
+                ]
                 ctx.client.run(clone_cmd, cwd=parent).check_ok("git clone")
+                self._repo(ctx).invalidate()
                 log.info("  ✓ %s clone 完成", env)
             except Exception as e:
                 raise RuntimeError(f"{env} 同步失败: clone_err={clone_err}, clone={e}")
 
     def _verify_consistency(self, branch: str):
         """验证所有环境 HEAD 一致"""
+        # 每个环境一次 git 调用同时取得 HEAD 与分支
+        heads = self._for_each_env(
+            lambda env_name: self._repo(self._ctx(env_name)).head_and_branch(),
+            self.config.envs,
+        )
         commits = {}
-        for env_name in self.config.envs.keys():
-            ctx = self._ctx(env_name)
-            repo = GitRepo(ctx)
-            head = repo.head_commit()
+        for env_name, (head, current) in heads.items():
             commits[env_name] = head
-            log.info("  %s: %s", env_name, head[:8])
+            log.info("  %s: %s (%s)", env_name, head[:8], current)
+            if current != branch:
+                log.warning("  %s 当前分支为 %s，期望 %s", env_name, current, branch)
 
         unique_commits = set(commits.values())
         if len(unique_commits) > 1:
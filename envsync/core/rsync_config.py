@@ -1,12 +1,22 @@
 """
-rsync 共享配置：排除规则和通用参数
+rsync 共享配置：排除规则、通用参数与流式执行
 """
 from __future__ import annotations
 
-from typing import List
+import fnmatch
+import functools
+import hashlib
+import os
+import re
+import subprocess
+import tempfile
+from pathlib import Path
+from typing import Iterator, List, Optional, Sequence, Tuple
 
-# 通用排除规则
-RSYNC_EXCLUDES: List[str] = [
+from envsync.utils.ssh import SSH_CONTROL_OPTS, ensure_ssh_control_dir
+
+# 通用排除规则（不可变，build_rsync_args 的缓存依赖于此）
+RSYNC_EXCLUDES: Tuple[str, ...] = (
     "--exclude=.git",
     "--exclude=.envsync",
     "--exclude=node_modules",
@@ -17,11 +27,186 @@ RSYNC_EXCLUDES: List[str] = [
     "--exclude=*.swp",
     "--exclude=.venv",
     "--exclude=venv",
-]
+    "--exclude=.rsync-partial",
+)
+
+# 中断传输的残留文件目录（相对目标目录），见 build_rsync_args(partial=True)
+RSYNC_PARTIAL_DIR = ".rsync-partial"
 
 # 遵守 .gitignore 规则
 RSYNC_GITIGNORE_FILTER = "--filter=:- .gitignore"
 
+_FILTER_ARGS: Tuple[str, ...] = RSYNC_EXCLUDES + (RSYNC_GITIGNORE_FILTER,)
+
+# RSYNC_EXCLUDES 对应的文件名匹配（供进程内遍历目录树时使用）
+EXCLUDE_NAME_RE = re.compile(
+    "|".join(fnmatch.translate(a.split("=", 1)[1]) for a in RSYNC_EXCLUDES)
+)
+
+# 压缩只在跨网络传输时有意义，使用最低压缩级别，避免 CPU 成为瓶颈
+RSYNC_COMPRESS_ARGS: Tuple[str, ...] = ("--compress", "--compress-level=1")
+
+
+def should_compress(remote: bool) -> bool:
+    """
+    是否启用传输压缩：仅当有一端为远程环境时启用，
+    可通过环境变量 ENVSYNC_RSYNC_COMPRESS=false 关闭（如千兆局域网内）
+    """
+    if not remote:
+        return False
+    return os.environ.get("ENVSYNC_RSYNC_COMPRESS", "").lower() not in ("0", "false", "no")
+
+
+def compress_args(remote: bool) -> Tuple[str, ...]:
+    """手工拼装 rsync 命令时使用的压缩参数，不压缩时为空"""
+    return RSYNC_COMPRESS_ARGS if should_compress(remote) else ()
+
+
+# 远程 rsync 复用 SSH 连接，与 SSHClientWrapper 的远程命令共享同一控制连接
+RSYNC_SSH_ARG = "--rsh=ssh " + " ".join(SSH_CONTROL_OPTS)
+
+
+def _gitignore_rules(prefix: str, text: str) -> List[str]:
+    """
+    将一个 .gitignore 的规则转换为 rsync 过滤规则（锚定到其所在目录 prefix）。
+    rsync 首条匹配生效而 git 末条匹配生效，因此规则按倒序输出
+    """
+    rules: List[str] = []
+    for raw in text.splitlines():
+        line = raw.rstrip()
+        if not line or line.startswith("#"):
+            continue
+        action = "-"
+        if line.startswith("!"):
+            action, line = "+", line[1:]
+        elif line.startswith("\\"):
+            line = line[1:]
+        dir_only = line.endswith("/")
+        body = line.rstrip("/")
+        if not body:
+            continue
+        suffix = "/" if dir_only else ""
+        if "/" in body:
+            # 含斜杠的模式相对 .gitignore 所在目录锚定
+            patterns = [f"/{prefix}{body.lstrip('/')}"]
+        elif prefix:
+            # 不含斜杠的模式匹配该目录下任意层级
+            patterns = [f"/{prefix}{body}", f"/{prefix}**/{body}"]
+        else:
+            patterns = [body]
+        rules.extend(f"{action} {p}{suffix}" for p in patterns)
+    rules.reverse()
+    return rules
+
+
+def _gitignore_dirs(root: Path) -> List[str]:
+    """
+    root 下含有生效 .gitignore 的目录（相对路径，根目录为 "."）。
+    git 仓库内由 git ls-files 列出（git 自身会跳过已忽略的目录，不进入 node_modules、构建产物等）；
+    非 git 仓库或 git 不可用时退回 os.walk，仅跳过 RSYNC_EXCLUDES 中的目录
+    """
+    try:
+        proc = subprocess.run(
+            ["git", "-C", str(root), "ls-files", "-z", "--cached", "--others", "--exclude-standard",
+             "--", "*.gitignore"],
+            capture_output=True,
+            text=True,
+        )
+    except OSError:
+        proc = None
+    if proc is not None and proc.returncode == 0:
+        dirs = []
+        for path in proc.stdout.split("\0"):
+            parts = path.split("/")
+            if parts[-1] != ".gitignore" or any(EXCLUDE_NAME_RE.match(p) for p in parts[:-1]):
+                continue
+            dirs.append(os.path.join(*parts[:-1]) if len(parts) > 1 else ".")
+        return dirs
+
+    dirs = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [d for d in dirnames if not EXCLUDE_NAME_RE.match(d)]
+        if ".gitignore" in filenames:
+            dirs.append(os.path.relpath(dirpath, root))
+    return dirs
+
+
+def build_merged_filter(root: Path) -> Path:
+    """
+    收集 root 下所有 .gitignore（见 _gitignore_dirs），合并为单个 rsync 过滤文件，
+    代替 rsync 在每个目录读取 .gitignore（:- .gitignore）。
+    结果缓存在 ~/.envsync/cache，任一 .gitignore 增删或修改后重新生成
+    """
+    found: List[Tuple[str, os.stat_result]] = []
+    for rel in _gitignore_dirs(root):
+        try:
+            found.append((rel, os.stat(os.path.join(root, rel, ".gitignore"))))
+        except OSError:
+            # 已跟踪但工作区中被删除
+            continue
+    # 深层目录的规则优先（与 git 语义一致）
+    found.sort(key=lambda item: (-item[0].count(os.sep) if item[0] != "." else 1, item[0]))
+
+    signature = hashlib.blake2b(digest_size=16)
+    for rel, st in found:
+        signature.update(f"{rel}\0{st.st_mtime_ns}\0{st.st_size}\n".encode())
+    header = f"# envsync merged .gitignore filter {signature.hexdigest()}\n"
+
+    cache_dir = Path.home() / ".envsync" / "cache"
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    root_key = hashlib.blake2b(str(Path(root).resolve()).encode(), digest_size=8).hexdigest()
+    out = cache_dir / f"merged-filter-{root_key}.rsync"
+    try:
+        with open(out, encoding="utf-8") as f:
+            if f.readline() == header:
+                return out
+    except OSError:
+        pass
+
+    lines = [header]
+    for rel, _ in found:
+        prefix = "" if rel == "." else rel.replace(os.sep, "/") + "/"
+        with open(os.path.join(root, rel, ".gitignore"), encoding="utf-8", errors="replace") as f:
+            lines.extend(f"{rule}\n" for rule in _gitignore_rules(prefix, f.read()))
+    tmp = out.with_suffix(f".tmp{os.getpid()}")
+    tmp.write_text("".join(lines), encoding="utf-8")
+    os.replace(tmp, out)
+    return out
+
+
+def gitignore_filter_for(path: str, local: bool) -> Optional[str]:
+    """
+    源目录为本地时返回合并后的过滤文件路径（供 build_rsync_args(merged_filter=...)），
+    远程源或生成失败时返回 None，回退为 rsync 逐目录读取 .gitignore
+    """
+    if not local or not os.path.isdir(path):
+        return None
+    try:
+        return str(build_merged_filter(Path(path)))
+    except OSError:
+        return None
+
+
+@functools.lru_cache(maxsize=1)
+def _rsync_version_output() -> str:
+    """本机 `rsync --version` 的输出（只执行一次），无法执行时为空"""
+    try:
+        return subprocess.run(["rsync", "--version"], capture_output=True, text=True).stdout
+    except OSError:
+        return ""
+
+
+@functools.lru_cache(maxsize=1)
+def rsync_checksums() -> frozenset:
+    """
+    本机 rsync 支持的校验和算法（--version 中 "Checksum list:" 的下一行）。
+    3.2 以下版本没有该段，编译时未启用 xxhash 的 3.2+ 也不含 xxh3，均据此判断
+    """
+    m = re.search(r"^Checksum list:\s*\n\s*(.+)$", _rsync_version_output(), re.MULTILINE)
+    if not m:
+        return frozenset()
+    return frozenset(re.sub(r"\([^)]*\)", " ", m.group(1)).split())
+
 
 def build_rsync_args(
     *,
@@ -30,6 +215,12 @@ def build_rsync_args(
     delete: bool = True,
     progress: bool = False,
     itemize: bool = False,
+    partial: bool = False,
+    delay_updates: bool = False,
+    fuzzy: bool = False,
+    compress: bool = False,
+    merged_filter: Optional[str] = None,
+    fast_checksum: bool = False,
 ) -> List[str]:
     """
     构建 rsync 参数列表
@@ -40,30 +231,146 @@ def build_rsync_args(
         delete: 删除目标端多余文件
         progress: 显示进度
         itemize: 显示详细变更
+        partial: 中断的传输保留到 .rsync-partial，重试时从已传部分继续
+        delay_updates: 所有文件传输完成后再统一替换，减少目标处于半更新状态的时间
+        fuzzy: 目标缺失文件时在同目录查找相似文件作为增量基准（适合重命名）。
+            与 delete 同时开启时改用 --delete-delay，传输结束后才删除，使被重命名的旧文件仍可作为基准
+        compress: 传输时压缩（低压缩级别），仅适合跨网络传输，见 should_compress
+        merged_filter: 合并后的 .gitignore 过滤文件（见 build_merged_filter），
+            为 None 时由 rsync 逐目录读取 .gitignore
+        fast_checksum: checksum 比较时指定 xxh3 算法（本机 rsync 支持 xxh3 时生效，见 rsync_checksums）。
+            需两端 rsync 都支持，远程端版本未知时不要开启（3.2 起两端会自动协商）
+
+    返回新的列表，调用方可直接 extend；底层按参数组合缓存为不可变元组。
     """
+    ensure_ssh_control_dir()
+    return list(_rsync_args(
+        dry_run, checksum, delete, progress, itemize,
+        partial, delay_updates, fuzzy, compress, merged_filter, fast_checksum,
+    ))
+
+
+@functools.lru_cache(maxsize=32)
+def _rsync_args(
+    dry_run: bool,
+    checksum: bool,
+    delete: bool,
+    progress: bool,
+    itemize: bool,
+    partial: bool,
+    delay_updates: bool,
+    fuzzy: bool,
+    compress: bool,
+    merged_filter: Optional[str],
+    fast_checksum: bool,
+) -> Tuple[str, ...]:
     args = ["rsync"]
     
     # 基础参数
     base_flags = "-a"  # archive mode
     if dry_run:
         base_flags += "n"  # dry-run
-    base_flags += "z"  # compress
     args.append(base_flags)
+
+    if compress:
+        args.extend(RSYNC_COMPRESS_ARGS)
     
     if checksum:
         args.append("--checksum")
+        if fast_checksum and "xxh3" in rsync_checksums():
+            args.append("--checksum-choice=xxh3")
     
     if delete:
-        args.append("--delete")
+        # 默认的 --delete-during 会在 --fuzzy 查找基准前删掉旧文件
+        args.append("--delete-delay" if fuzzy else "--delete")
     
     if progress:
         args.append("--info=stats2,progress2")
     
     if itemize:
         args.append("--itemize-changes")
+
+    if partial:
+        args.append(f"--partial-dir={RSYNC_PARTIAL_DIR}")
+
+    if delay_updates:
+        args.append("--delay-updates")
+
+    if fuzzy:
+        args.append("--fuzzy")
+
+    args.append(RSYNC_SSH_ARG)
     
     # 添加排除规则
-    args.extend(RSYNC_EXCLUDES)
-    args.append(RSYNC_GITIGNORE_FILTER)
+    if merged_filter:
+        args.extend(RSYNC_EXCLUDES)
+        args.append(f"--filter=merge {merged_filter}")
+    else:
+        args.extend(_FILTER_ARGS)
     
-    return args
+    return tuple(args)
+
+
+class RsyncStream:
+    """
+    流式执行 rsync：stdout 逐行迭代，内存占用与输出规模无关。
+    stderr 写入临时文件，避免 stdout/stderr 双管道互相阻塞。
+    退出上下文时若进程仍在运行（调用方提前结束读取）则终止进程。
+
+        with RsyncStream(cmd) as stream:
+            for line in stream.lines():
+                ...
+            code = stream.wait()
+    """
+
+    def __init__(self, cmd: Sequence[str]):
+        self._stderr = tempfile.TemporaryFile(mode="w+", encoding="utf-8", errors="replace")
+        self.proc = subprocess.Popen(
+            list(cmd),
+            stdout=subprocess.PIPE,
+            stderr=self._stderr,
+            text=True,
+            errors="replace",
+            bufsize=1,
+        )
+
+    def __enter__(self) -> "RsyncStream":
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.proc.poll() is None:
+            self.proc.terminate()
+        self.proc.wait()
+        self.proc.stdout.close()
+        self._stderr.close()
+
+    def lines(self) -> Iterator[str]:
+        for line in self.proc.stdout:
+            yield line.rstrip("\n")
+
+    def blocks(self, size: int = 64 * 1024) -> Iterator[str]:
+        """
+        按块读取 stdout，每块只包含完整的行（末尾不完整的行并入下一块），
+        便于调用方用编译好的正则（re.MULTILINE）整块匹配而不是逐行循环
+        """
+        pending = ""
+        while True:
+            chunk = self.proc.stdout.read(size)
+            if not chunk:
+                break
+            chunk = pending + chunk
+            cut = chunk.rfind("\n") + 1
+            if cut:
+                pending = chunk[cut:]
+                yield chunk[:cut]
+            else:
+                pending = chunk
+        if pending:
+            yield pending + "\n"
+
+    def wait(self) -> int:
+        return self.proc.wait()
+
+    def stderr(self) -> str:
+        self._stderr.seek(0)
+        return self._stderr.read()
@@ -4,15 +4,31 @@
 from __future__ import annotations
 
 import hashlib
+import itertools
+import json
+import os
+import re
+import shutil
 import subprocess
 import time
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Dict, List, Optional, Literal
+from typing import Dict, Iterator, List, Literal, Optional, Tuple
 
 from envsync.core.config import ConfigData
-from envsync.core.rsync_config import build_rsync_args, RSYNC_EXCLUDES
-from envsync.utils.envs import EnvContext
+from envsync.core.rsync_config import (
+    build_rsync_args,
+    ensure_ssh_control_dir,
+    compress_args,
+    EXCLUDE_NAME_RE,
+    gitignore_filter_for,
+    RSYNC_EXCLUDES,
+    RSYNC_SSH_ARG,
+    RsyncStream,
+    should_compress,
+)
+from envsync.utils.envs import EnvContext, context_for
 from envsync.utils.git import GitRepo
 from envsync.utils.logger import get_logger
 
@@ -24,6 +40,113 @@ def _get_scanner():
 log = get_logger(__name__)
 
 
+# itemize 输出统计：传输的文件以 < 或 > 开头，删除的文件以 *deleting 开头
+_SENT_RE = re.compile(r"^[<>]", re.MULTILINE)
+_DELETED_RE = re.compile(r"^\*deleting", re.MULTILINE)
+
+
+def _iter_tree(root: Path) -> Iterator[Tuple[str, os.DirEntry]]:
+    """遍历目录树，产出 (相对路径, DirEntry)，跳过 RSYNC_EXCLUDES 中的名称，不跟随符号链接"""
+    stack = [(str(root), "")]
+    while stack:
+        path, rel = stack.pop()
+        with os.scandir(path) as it:
+            for entry in it:
+                if EXCLUDE_NAME_RE.match(entry.name):
+                    continue
+                name = f"{rel}/{entry.name}" if rel else entry.name
+                yield name, entry
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append((entry.path, name))
+
+
+def _tree_digest(root: Path) -> str:
+    """
+    备份目录树的元数据摘要：按相对路径排序，将每个文件的 (路径, 权限, 大小, 修改时间)
+    或符号链接目标折叠进一个 blake2b。只 stat 不读取内容，开销与文件数成正比而与数据量无关
+    """
+    files = sorted(
+        ((name, entry) for name, entry in _iter_tree(root) if not entry.is_dir(follow_symlinks=False)),
+        key=lambda item: item[0],
+    )
+    digest = hashlib.blake2b(digest_size=32)
+    for name, entry in files:
+        st = entry.stat(follow_symlinks=False)
+        if entry.is_symlink():
+            digest.update(f"{name}\0L\0{os.readlink(entry.path)}\n".encode())
+        else:
+            digest.update(f"{name}\0{st.st_mode}\0{st.st_size}\0{st.st_mtime_ns}\n".encode())
+    return digest.hexdigest()
+
+
+def _copy_file(src: str, dst: str, size: int):
+    """复制单个文件及其元数据：优先 copy_file_range（内核内复制，CoW 文件系统上为 reflink），不支持时退回 shutil"""
+    try:
+        with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+            remaining = size
+            while remaining > 0:
+                n = os.copy_file_range(fsrc.fileno(), fdst.fileno(), remaining)
+                if n == 0:
+                    break
+                remaining -= n
+    except (AttributeError, OSError):
+        shutil.copyfile(src, dst)
+    shutil.copystat(src, dst)
+
+
+def _local_backup(src: Path, dst: Path, link_dest: Optional[Path] = None):
+    """
+    本地环境备份：进程内遍历复制，不启动 rsync。排除规则与 RSYNC_EXCLUDES 一致；
+    与 link_dest 中大小、修改时间、权限均相同的文件直接硬链接（等同 rsync --link-dest）
+    """
+    files: List[tuple] = []
+    dirs: List[tuple] = []
+
+    def walk(path: str, target_dir: str, rel: str):
+        with os.scandir(path) as it:
+            for entry in it:
+                if EXCLUDE_NAME_RE.match(entry.name):
+                    continue
+                target = os.path.join(target_dir, entry.name)
+                name = os.path.join(rel, entry.name)
+                if entry.is_symlink():
+                    os.symlink(os.readlink(entry.path), target)
+                elif entry.is_dir():
+                    os.mkdir(target)
+                    walk(entry.path, target, name)
+                    dirs.append((entry.path, target))
+                elif entry.is_file():
+                    files.append((entry.path, target, name, entry.stat()))
+                else:
+                    # socket、FIFO、设备文件无法作为普通文件备份（rsync -a 不带 -D 时同样跳过）
+                    log.warning("跳过特殊文件: %s", entry.path)
+
+    # 源目录不存在时得到空备份（与 rsync 返回 23 时的行为一致）
+    if not src.is_dir():
+        return
+    walk(str(src), str(dst), "")
+
+    def copy(job: tuple):
+        path, target, name, st = job
+        if link_dest is not None:
+            try:
+                prev = os.path.join(link_dest, name)
+                pst = os.stat(prev, follow_symlinks=False)
+                if (pst.st_size, pst.st_mtime_ns, pst.st_mode) == (st.st_size, st.st_mtime_ns, st.st_mode):
+                    os.link(prev, target)
+                    return
+            except OSError:
+                pass
+        _copy_file(path, target, st.st_size)
+
+    with ThreadPoolExecutor(max_workers=8) as ex:
+        list(ex.map(copy, files))
+    # 子目录先于父目录恢复修改时间（dirs 已是后序）
+    for path, target in dirs:
+        shutil.copystat(path, target)
+    shutil.copystat(src, dst)
+
+
 @dataclass
 class SyncCheckpoint:
     """同步检查点，用于回滚"""
@@ -31,6 +154,7 @@ class SyncCheckpoint:
     env_name: str
     backup_path: str
     git_commit: Optional[str] = None
+    # {"_meta": 备份目录树元数据摘要}，见 _tree_digest
     file_checksums: Dict[str, str] = field(default_factory=dict)
 
     def to_dict(self) -> dict:
@@ -42,6 +166,26 @@ class SyncCheckpoint:
             "file_checksums": self.file_checksums,
         }
 
+    @classmethod
+    def from_dict(cls, data: dict) -> "SyncCheckpoint":
+        """
+        从元数据还原检查点。仅保留目录树摘要：旧版本元数据中的逐文件校验和不再使用，
+        丢弃后列出大量检查点时不必常驻内存；未知字段同样忽略
+        """
+        checksums = data.get("file_checksums") or {}
+        return cls(
+            timestamp=data["timestamp"],
+            env_name=data["env_name"],
+            backup_path=data["backup_path"],
+            git_commit=data.get("git_commit"),
+            file_checksums={"_meta": checksums["_meta"]} if "_meta" in checksums else {},
+        )
+
+    @property
+    def tree_digest(self) -> Optional[str]:
+        """备份目录树的元数据摘要，旧检查点没有时为 None"""
+        return self.file_checksums.get("_meta")
+
 
 @dataclass
 class SyncResult:
@@ -84,6 +228,8 @@ class SafeSyncService:
 
     def __init__(self, config: ConfigData):
         self.config = config
+        self._ctx_cache: Dict[str, EnvContext] = {}
+        self._repo_cache: Dict[str, GitRepo] = {}
         self.checkpoint_dir = Path.home() / ".envsync" / "checkpoints"
         self.checkpoint_dir.mkdir(parents=True, exist_ok=True)
 
@@ -118,6 +264,7 @@ class SafeSyncService:
 
         checkpoint: Optional[SyncCheckpoint] = None
         extra_excludes: List[str] = []
+        exclude_file: Optional[Path] = None
         synced_components: List[str] = []
 
         try:
@@ -134,11 +281,45 @@ class SafeSyncService:
                     synced_components = [t for t in synced_components if t in components]
                 log.info("  扫描完成: %d 组件, 排除 %d 目录",
                          len(src_structure.components), len(src_structure.all_non_code_dirs))
+                if extra_excludes:
+                    # 排除规则可能有数百条，写入文件供本次同步的各次 rsync 复用
+                    exclude_file = self._write_exclude_file(extra_excludes)
+                    extra_excludes = [f"--exclude-from={exclude_file}"]
+
+            # 源为本地时合并 .gitignore 为单个过滤文件，本次各次 rsync 共用
+            merged_filter = gitignore_filter_for(ctx_src.entry.path, ctx_src.is_local)
 
             # 1. 检查目标环境状态
             if strategy == "safe":
                 self._check_clean_target(ctx_dst)
 
+            # 预检：与实际同步使用相同的比较方式（safe 策略逐字节比较），无任何差异时跳过备份与同步。
+            # 发现第一处差异即停止，有变更时只多读取到该文件为止
+            probe_checksum = strategy == "safe"
+            if not self._probe_changes(
+                ctx_src, ctx_dst,
+                checksum=probe_checksum,
+                extra_excludes=extra_excludes,
+                merged_filter=merged_filter,
+            ):
+                log.info("未检测到变更，跳过备份与同步")
+                verified = False
+                if verify:
+                    # 逐字节预检无差异本身即是一致性校验，否则另行校验
+                    verified = probe_checksum or self._verify_sync(
+                        ctx_src, ctx_dst,
+                        extra_excludes=extra_excludes,
+                        merged_filter=merged_filter,
+                    )
+                return SyncResult(
+                    success=True,
+                    source=source,
+                    target=target,
+                    verified=verified,
+                    code_only=code_only,
+                    components_synced=synced_components,
+                )
+
             # 2. 创建备份检查点
             if backup:
                 log.info("步骤 1/4: 创建备份检查点...")
@@ -151,14 +332,21 @@ class SafeSyncService:
                 ctx_src, ctx_dst,
                 checksum=strategy == "safe",
                 extra_excludes=extra_excludes,
+                merged_filter=merged_filter,
             )
+            # 目标工作区已被改写，缓存的 git 状态失效
+            self._repo(ctx_dst).invalidate()
             log.info("  同步完成: %d 文件, 删除 %d 文件", synced, deleted)
 
             # 4. 校验一致性
             verified = False
             if verify:
                 log.info("步骤 3/4: 校验文件一致性...")
-                verified = self._verify_sync(ctx_src, ctx_dst, extra_excludes=extra_excludes)
+                verified = self._verify_sync(
+                    ctx_src, ctx_dst,
+                    extra_excludes=extra_excludes,
+                    merged_filter=merged_filter,
+                )
                 if verified:
                     log.info("  ✓ 校验通过")
                 else:
@@ -190,6 +378,9 @@ class SafeSyncService:
                 checkpoint=checkpoint,
                 error=str(e),
             )
+        finally:
+            if exclude_file is not None:
+                exclude_file.unlink(missing_ok=True)
 
     def rollback(self, target: str, checkpoint_id: Optional[str] = None) -> bool:
         """
@@ -210,11 +401,17 @@ class SafeSyncService:
         log.info("开始回滚 %s 到检查点 %s", target, checkpoint.timestamp)
 
         try:
+            # 恢复前确认备份未被改动或损坏
+            expected = checkpoint.tree_digest
+            if expected and _tree_digest(Path(checkpoint.backup_path)) != expected:
+                raise RuntimeError(f"备份校验失败，内容已变化: {checkpoint.backup_path}")
+
             # 使用 rsync 从备份恢复
             backup_spec = checkpoint.backup_path.rstrip("/") + "/"
             target_spec = ctx.rsync_spec()
 
-            cmd = ["rsync", "-az", "--delete"]
+            ensure_ssh_control_dir()
+            cmd = ["rsync", "-a", "--delete", RSYNC_SSH_ARG, *compress_args(ctx.is_remote)]
             cmd.extend(RSYNC_EXCLUDES)
             cmd.extend([backup_spec, target_spec])
 
@@ -225,7 +422,7 @@ class SafeSyncService:
             # 如果有 Git commit 记录，尝试恢复
             if checkpoint.git_commit:
                 try:
-                    repo = GitRepo(ctx)
+                    repo = self._repo(ctx)
                     repo.reset_hard(checkpoint.git_commit)
                     log.info("  Git 已恢复到 %s", checkpoint.git_commit[:8])
                 except Exception as e:
@@ -240,45 +437,64 @@ class SafeSyncService:
 
     def list_checkpoints(self, env: str) -> List[SyncCheckpoint]:
         """列出环境的所有检查点"""
-        import json
-        checkpoints = []
-        pattern = f"checkpoint-{env}-*.json"
-        for f in self.checkpoint_dir.glob(pattern):
+        prefix = f"checkpoint-{env}-"
+        with os.scandir(self.checkpoint_dir) as it:
+            paths = [e.path for e in it if e.name.startswith(prefix) and e.name.endswith(".json")]
+        if not paths:
+            return []
+
+        def load(path: str) -> Optional[SyncCheckpoint]:
             try:
-                data = json.loads(f.read_text())
-                checkpoints.append(SyncCheckpoint(**data))
+                with open(path, encoding="utf-8") as f:
+                    return SyncCheckpoint.from_dict(json.load(f))
             except Exception:
-                continue
+                return None
+
+        # 读取以 I/O 为主，并发读取各元数据文件
+        with ThreadPoolExecutor(max_workers=min(8, len(paths))) as ex:
+            checkpoints = [cp for cp in ex.map(load, paths) if cp is not None]
         return sorted(checkpoints, key=lambda c: c.timestamp, reverse=True)
 
     def cleanup_checkpoints(self, env: str, keep: int = 5):
-        """清理旧检查点，保留最近 N 个"""
+        """
+        清理旧检查点，保留最近 N 个
+
+        备份之间通过 --link-dest 共享未变化文件的硬链接，删除旧备份只释放
+        其独有的文件，仍被较新备份引用的内容不会释放磁盘空间
+        """
         checkpoints = self.list_checkpoints(env)
-        for cp in checkpoints[keep:]:
+        victims = checkpoints[keep:]
+
+        def remove(cp: SyncCheckpoint):
             # 删除备份目录
-            import shutil
             backup_path = Path(cp.backup_path)
             if backup_path.exists():
                 shutil.rmtree(backup_path)
             # 删除元数据文件
             meta_file = self.checkpoint_dir / f"checkpoint-{env}-{cp.timestamp}.json"
-            if meta_file.exists():
-                meta_file.unlink()
+            meta_file.unlink(missing_ok=True)
+
+        # 各备份目录互不相关，并发删除
+        if victims:
+            with ThreadPoolExecutor(max_workers=min(8, len(victims))) as ex:
+                list(ex.map(remove, victims))
         log.info("清理完成，保留 %d 个检查点", min(keep, len(checkpoints)))
 
     def _ctx(self, env: str) -> EnvContext:
-        if env not in self.config.envs:
-            raise ValueError(f"环境未配置: {env}")
-        return EnvContext(name=env, entry=self.config.envs[env])
+        return context_for(self._ctx_cache, self.config.envs, env)
+
+    def _repo(self, ctx: EnvContext) -> GitRepo:
+        repo = self._repo_cache.get(ctx.name)
+        if repo is None:
+            repo = self._repo_cache[ctx.name] = GitRepo(ctx)
+        return repo
 
     def _check_clean_target(self, ctx: EnvContext):
         """检查目标环境是否干净"""
         try:
-            repo = GitRepo(ctx)
-            repo.ensure_repo()
-            status = repo.status()
-            if status.dirty:
-                details = "\n".join(status.short_status[:10])
+            snapshot = self._repo(ctx).snapshot()
+            if snapshot.dirty:
+                details = "\n".join(snapshot.short_status[:10])
                 raise RuntimeError(
                     f"目标 {ctx.display} 有未提交变更，请先处理：\n{details}"
                 )
@@ -289,25 +505,47 @@ class SafeSyncService:
 
     def _create_checkpoint(self, ctx: EnvContext) -> SyncCheckpoint:
         """创建备份检查点"""
-        import json
-
-        timestamp = time.strftime("%Y%m%d-%H%M%S")
-        backup_dir = self.checkpoint_dir / f"backup-{ctx.name}-{timestamp}"
-        backup_dir.mkdir(parents=True, exist_ok=True)
+        # 同一秒内的多个检查点追加序号，避免共用备份目录
+        self.checkpoint_dir.mkdir(parents=True, exist_ok=True)
+        base = time.strftime("%Y%m%d-%H%M%S")
+        timestamp = base
+        for n in itertools.count(1):
+            backup_dir = self.checkpoint_dir / f"backup-{ctx.name}-{timestamp}"
+            try:
+                backup_dir.mkdir()
+                break
+            except FileExistsError:
+                timestamp = f"{base}-{n}"
+
+        # 未变化的文件硬链接到上一个备份，只写入变化部分
+        previous = next(
+            (cp for cp in self.list_checkpoints(ctx.name) if Path(cp.backup_path).is_dir()),
+            None,
+        )
+        link_dest = Path(previous.backup_path).resolve() if previous else None
 
-        # rsync 备份
-        cmd = ["rsync", "-az"]
-        cmd.extend(RSYNC_EXCLUDES)
-        cmd.extend([ctx.rsync_spec(), str(backup_dir) + "/"])
+        if ctx.is_local:
+            # 本地环境直接在进程内复制，省去 rsync 进程与逐文件比对
+            try:
+                _local_backup(Path(ctx.entry.path), backup_dir, link_dest)
+            except OSError as e:
+                raise RuntimeError(f"备份失败: {e}")
+        else:
+            ensure_ssh_control_dir()
+            cmd = ["rsync", "-a", RSYNC_SSH_ARG, *compress_args(ctx.is_remote)]
+            if link_dest:
+                cmd.append(f"--link-dest={link_dest}")
+            cmd.extend(RSYNC_EXCLUDES)
+            cmd.extend([ctx.rsync_spec(), str(backup_dir) + "/"])
 
-        proc = subprocess.run(cmd, capture_output=True, text=True)
-        if proc.returncode not in (0, 23):
-            raise RuntimeError(f"备份失败: {proc.stderr}")
+            proc = subprocess.run(cmd, capture_output=True, text=True)
+            if proc.returncode not in (0, 23):
+                raise RuntimeError(f"备份失败: {proc.stderr}")
 
         # 获取 Git commit
         git_commit = None
         try:
-            repo = GitRepo(ctx)
+            repo = self._repo(ctx)
             repo.ensure_repo()
             git_commit = repo.head_commit()
         except Exception:
@@ -318,20 +556,33 @@ class SafeSyncService:
             env_name=ctx.name,
             backup_path=str(backup_dir),
             git_commit=git_commit,
+            file_checksums={"_meta": _tree_digest(backup_dir)},
         )
 
-        # 保存元数据
+        # 保存元数据（紧凑 JSON；list_checkpoints 同样可读取旧的缩进格式）
         meta_file = self.checkpoint_dir / f"checkpoint-{ctx.name}-{timestamp}.json"
-        meta_file.write_text(json.dumps(checkpoint.to_dict(), indent=2))
+        meta_file.write_text(
+            json.dumps(checkpoint.to_dict(), separators=(",", ":"), ensure_ascii=False),
+            encoding="utf-8",
+        )
 
         return checkpoint
 
+    def _write_exclude_file(self, excludes: List[str]) -> Path:
+        """将 --exclude=模式 参数写入 rsync --exclude-from 文件（每行一个模式）"""
+        prefix = "--exclude="
+        path = self.checkpoint_dir / f"excludes-{os.getpid()}-{time.strftime('%Y%m%d-%H%M%S')}.txt"
+        patterns = (e[len(prefix):] if e.startswith(prefix) else e for e in excludes)
+        path.write_text("\n".join(patterns) + "\n", encoding="utf-8")
+        return path
+
     def _do_sync(
         self,
         src: EnvContext,
         dst: EnvContext,
         checksum: bool,
         extra_excludes: Optional[List[str]] = None,
+        merged_filter: Optional[str] = None,
     ) -> tuple[int, int]:
         """执行同步，返回 (同步文件数, 删除文件数)"""
         args = build_rsync_args(
@@ -340,23 +591,27 @@ class SafeSyncService:
             delete=True,
             progress=True,
             itemize=True,
+            partial=True,
+            delay_updates=True,
+            fuzzy=True,
+            compress=should_compress(src.is_remote or dst.is_remote),
+            merged_filter=merged_filter,
+            fast_checksum=src.is_local and dst.is_local,
         )
         # 添加额外排除规则（代码扫描结果）
         if extra_excludes:
             args.extend(extra_excludes)
         args.extend([src.rsync_spec(), dst.rsync_spec()])
 
-        proc = subprocess.run(args, capture_output=True, text=True)
-        if proc.returncode not in (0, 23):
-            raise RuntimeError(f"rsync 同步失败: {proc.stderr or proc.stdout}")
-
-        # 解析结果统计
+        # 按块读取并用正则整块计数，不缓存完整输出
         synced = deleted = 0
-        for line in proc.stdout.splitlines():
-            if line.startswith(">") or line.startswith("<"):
-                synced += 1
-            elif line.startswith("*deleting"):
-                deleted += 1
+        with RsyncStream(args) as stream:
+            for block in stream.blocks():
+                synced += len(_SENT_RE.findall(block))
+                deleted += len(_DELETED_RE.findall(block))
+            code = stream.wait()
+            if code not in (0, 23):
+                raise RuntimeError(f"rsync 同步失败: {stream.stderr() or f'exit {code}'}")
 
         return synced, deleted
 
@@ -365,36 +620,55 @@ class SafeSyncService:
         src: EnvContext,
         dst: EnvContext,
         extra_excludes: Optional[List[str]] = None,
+        merged_filter: Optional[str] = None,
     ) -> bool:
         """验证同步后的一致性"""
         # 使用 rsync dry-run + checksum 验证
+        return not self._probe_changes(
+            src, dst,
+            checksum=True,
+            extra_excludes=extra_excludes,
+            merged_filter=merged_filter,
+        )
+
+    def _probe_changes(
+        self,
+        src: EnvContext,
+        dst: EnvContext,
+        checksum: bool,
+        extra_excludes: Optional[List[str]] = None,
+        merged_filter: Optional[str] = None,
+    ) -> bool:
+        """
+        rsync dry-run 探测 src → dst 是否存在差异。
+        出现第一条差异行即返回 True 并终止 rsync；rsync 出错时同样返回 True，交由后续步骤处理
+        """
         args = build_rsync_args(
             dry_run=True,
-            checksum=True,
+            checksum=checksum,
             delete=True,
             itemize=True,
+            merged_filter=merged_filter,
+            fast_checksum=src.is_local and dst.is_local,
         )
         if extra_excludes:
             args.extend(extra_excludes)
         args.extend([src.rsync_spec(), dst.rsync_spec()])
 
-        proc = subprocess.run(args, capture_output=True, text=True)
-        if proc.returncode not in (0, 23):
-            return False
-
-        # 如果没有差异输出，说明一致
-        diff_lines = [ln for ln in proc.stdout.splitlines() if ln.strip() and not ln.startswith("building")]
-        return len(diff_lines) == 0
+        with RsyncStream(args) as stream:
+            for ln in stream.lines():
+                if ln.strip() and not ln.startswith("building"):
+                    return True
+            return stream.wait() not in (0, 23)
 
     def _auto_commit(self, ctx: EnvContext, message: str):
         """自动提交变更"""
         try:
-            repo = GitRepo(ctx)
-            repo.ensure_repo()
-            status = repo.status()
-            if status.dirty:
+            repo = self._repo(ctx)
+            if repo.snapshot().dirty:
                 ctx.client.run("git add -A", cwd=ctx.entry.path)
                 ctx.client.run(f'git commit -m "{message}"', cwd=ctx.entry.path)
+                repo.invalidate()
                 log.info("  自动提交完成")
         except Exception as e:
             log.warning("  自动提交失败: %s", e)
@@ -3,13 +3,17 @@
 """
 from __future__ import annotations
 
+import hashlib
 import json
+import re
+import shlex
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Dict, List, Optional, Set, Literal
+from typing import Dict, List, Optional, Set, Literal, Tuple
 
 from envsync.core.config import ConfigData
-from envsync.utils.envs import EnvContext
+from envsync.utils.envs import EnvContext, context_for
 from envsync.utils.logger import get_logger
 
 log = get_logger(__name__)
@@ -26,6 +30,10 @@ PROJECT_MARKERS = {
     "php": ["composer.json", "composer.lock"],
 }
 
+# 标记文件名 -> 项目类型；_TYPE_PRIORITY 为 PROJECT_MARKERS 中的顺序，同一目录命中多种类型时靠前者优先
+MARKER_INDEX = {m: t for t, ms in PROJECT_MARKERS.items() for m in ms}
+_TYPE_PRIORITY = {t: i for i, t in enumerate(PROJECT_MARKERS)}
+
 # 非代码目录（依赖、构建产物、缓存等）
 NON_CODE_DIRS = {
     # Python
@@ -49,6 +57,24 @@ NON_CODE_DIRS = {
     ".envsync",
 }
 
+# NON_CODE_DIRS 预编译：精确名称用集合查找，"*后缀" 模式合并为一个正则
+_NON_CODE_LITERALS = frozenset(p for p in NON_CODE_DIRS if not p.startswith("*"))
+_NON_CODE_SUFFIX_RE = re.compile(
+    "(?:{})$".format("|".join(re.escape(p[1:]) for p in sorted(NON_CODE_DIRS) if p.startswith("*")))
+)
+
+# 目录扫描深度：项目根向下 SCAN_DEPTH 层内查找组件，组件内再分析 COMPONENT_DEPTH 层子目录
+SCAN_DEPTH = 5
+COMPONENT_DEPTH = 2
+
+# find 表达式：不进入隐藏目录与非代码目录；只匹配标记文件
+_FIND_PRUNE = "-type d \\( {} \\) -prune".format(
+    " -o ".join(f"-name {shlex.quote(p)}" for p in [".*", *sorted(NON_CODE_DIRS)])
+)
+_FIND_MARKERS = "\\( {} \\)".format(
+    " -o ".join(f"-name {shlex.quote(m)}" for m in sorted(MARKER_INDEX))
+)
+
 # 代码文件扩展名
 CODE_EXTENSIONS = {
     "python": {".py", ".pyx", ".pxd", ".pyi"},
@@ -93,17 +119,40 @@ class ProjectStructure:
     all_code_dirs: Set[str] = field(default_factory=set)
     all_non_code_dirs: Set[str] = field(default_factory=set)
     scan_time: str = ""
+    digest: str = ""  # fingerprint() 结果，扫描时计算并随缓存保存
+    cache_key: str = ""  # 扫描时的仓库状态（见 ProjectScanner._cache_key），为空表示非 git 仓库
+
+    def sorted_dirs(self) -> Tuple[List[str], List[str]]:
+        """排序后的 (all_code_dirs, all_non_code_dirs)，供序列化、指纹与 rsync 规则共用"""
+        return sorted(self.all_code_dirs), sorted(self.all_non_code_dirs)
 
     def to_dict(self) -> dict:
+        code_dirs, non_code_dirs = self.sorted_dirs()
         return {
             "root_path": self.root_path,
             "env_name": self.env_name,
             "components": [c.to_dict() for c in self.components],
-            "all_code_dirs": sorted(self.all_code_dirs),
-            "all_non_code_dirs": sorted(self.all_non_code_dirs),
+            "all_code_dirs": code_dirs,
+            "all_non_code_dirs": non_code_dirs,
             "scan_time": self.scan_time,
+            "digest": self.digest,
+            "cache_key": self.cache_key,
         }
 
+    def fingerprint(self) -> str:
+        """
+        结构指纹：对与环境无关的部分（组件、代码/非代码目录）做规范化 JSON 后取 sha256，
+        指纹相同即两个环境结构一致
+        """
+        code_dirs, non_code_dirs = self.sorted_dirs()
+        payload = {
+            "components": [c.to_dict() for c in self.components],
+            "all_code_dirs": code_dirs,
+            "all_non_code_dirs": non_code_dirs,
+        }
+        canonical = json.dumps(payload, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
     def summary(self) -> str:
         lines = [
             f"项目结构: {self.root_path}",
@@ -122,10 +171,7 @@ class ProjectStructure:
 
     def get_rsync_excludes(self) -> List[str]:
         """生成 rsync 排除规则"""
-        excludes = []
-        for d in sorted(self.all_non_code_dirs):
-            excludes.append(f"--exclude={d}")
-        return excludes
+        return [f"--exclude={d}" for d in sorted(self.all_non_code_dirs)]
 
     def get_rsync_includes(self, component_types: Optional[List[str]] = None) -> List[str]:
         """生成 rsync 包含规则（仅同步指定类型组件）"""
@@ -154,6 +200,7 @@ class ProjectScanner:
 
     def __init__(self, config: ConfigData):
         self.config = config
+        self._ctx_cache: Dict[str, EnvContext] = {}
         self.cache_dir = Path.home() / ".envsync" / "scans"
         self.cache_dir.mkdir(parents=True, exist_ok=True)
 
@@ -166,10 +213,11 @@ class ProjectScanner:
             force: 强制重新扫描（忽略缓存）
         """
         ctx = self._ctx(env)
+        cache_key = self._cache_key(ctx)
         
         # 检查缓存
         if not force:
-            cached = self._load_cache(env)
+            cached = self._load_cache(env, cache_key)
             if cached:
                 log.info("使用缓存的扫描结果: %s", env)
                 return cached
@@ -179,14 +227,21 @@ class ProjectScanner:
         structure = ProjectStructure(
             root_path=ctx.entry.path,
             env_name=env,
+            cache_key=cache_key,
         )
 
-        # 扫描项目
-        self._scan_directory(ctx, "", structure)
+        # 扫描项目：一次远程 find 取得目录与标记文件，之后全部在本地处理
+        dirs, markers = self._walk(ctx)
+        children: Dict[str, List[str]] = {}
+        for rel in dirs:
+            parent, _, name = rel.rpartition("/")
+            children.setdefault(parent, []).append(name)
+        self._scan_directory("", structure, dirs, children, markers)
         
         # 记录扫描时间
         import time
         structure.scan_time = time.strftime("%Y-%m-%d %H:%M:%S")
+        structure.digest = structure.fingerprint()
         
         # 保存缓存
         self._save_cache(env, structure)
@@ -202,8 +257,27 @@ class ProjectScanner:
         """
         比较两个环境的项目结构差异
         """
-        struct1 = self.scan(env1)
-        struct2 = self.scan(env2)
+        # 两个环境的扫描互不依赖且以 I/O 为主，并发执行
+        with ThreadPoolExecutor(max_workers=2) as ex:
+            future1 = ex.submit(self.scan, env1)
+            future2 = ex.submit(self.scan, env2)
+            struct1, struct2 = future1.result(), future2.result()
+
+        # 指纹一致时结构完全相同，无需逐项比较
+        digest1 = struct1.digest or struct1.fingerprint()
+        digest2 = struct2.digest or struct2.fingerprint()
+        if digest1 == digest2:
+            return {
+                "env1": env1,
+                "env2": env2,
+                "types_match": True,
+                "types_in_1_only": set(),
+                "types_in_2_only": set(),
+                "code_dirs_match": True,
+                "code_only_in_1": set(),
+                "code_only_in_2": set(),
+                "structure_compatible": True,
+            }
         
         # 比较组件
         types1 = {c.type for c in struct1.components}
@@ -226,85 +300,112 @@ class ProjectScanner:
         }
 
     def _ctx(self, env: str) -> EnvContext:
-        if env not in self.config.envs:
-            raise ValueError(f"环境未配置: {env}")
-        return EnvContext(name=env, entry=self.config.envs[env])
+        return context_for(self._ctx_cache, self.config.envs, env)
 
-    def _scan_directory(self, ctx: EnvContext, rel_path: str, structure: ProjectStructure, depth: int = 0):
-        """递归扫描目录"""
-        if depth > 5:  # 限制扫描深度
-            return
-        
-        full_path = f"{ctx.entry.path}/{rel_path}".rstrip("/")
-        
-        # 列出目录内容
-        result = ctx.client.run(f"ls -la {full_path} 2>/dev/null | head -100")
-        if result.code != 0:
-            return
-        
-        # 检查是否有项目标记文件
-        for proj_type, markers in PROJECT_MARKERS.items():
-            for marker in markers:
-                check = ctx.client.run(f"[ -f {full_path}/{marker} ] && echo found")
-                if "found" in check.stdout:
-                    # 发现项目组件
-                    component = self._analyze_component(ctx, rel_path, proj_type, structure)
-                    if component:
-                        structure.components.append(component)
-                    return  # 找到项目根，不再向下扫描
-
-        # 获取子目录列表
-        result = ctx.client.run(
-            f"find {full_path} -maxdepth 1 -type d -not -name '.*' 2>/dev/null | tail -20"
+    def _walk(self, ctx: EnvContext) -> Tuple[List[str], Dict[str, Set[str]]]:
+        """
+        两次 find 遍历整个项目（目录列表与标记文件并发查询，远程时共用同一 SSH 连接），
+        返回 (相对目录列表, {目录: 其中的标记文件名})。
+        隐藏目录与非代码目录本身会列出但不进入（find -prune）
+        """
+        root = ctx.entry.path.rstrip("/") or "/"
+        quoted = shlex.quote(root)
+        dir_cmd = (
+            f"find {quoted} -mindepth 1 -maxdepth {SCAN_DEPTH + COMPONENT_DEPTH} "
+            f"{_FIND_PRUNE} -print -o -type d -print 2>/dev/null"
         )
-        if result.code != 0:
+        file_cmd = (
+            f"find {quoted} -mindepth 1 -maxdepth {SCAN_DEPTH + 1} "
+            f"{_FIND_PRUNE} -o -type f {_FIND_MARKERS} -print 2>/dev/null"
+        )
+        with ThreadPoolExecutor(max_workers=2) as ex:
+            dir_future = ex.submit(ctx.client.run, dir_cmd)
+            file_future = ex.submit(ctx.client.run, file_cmd)
+            dir_res, file_res = dir_future.result(), file_future.result()
+        # find 遇到个别不可读目录时返回非零但仍有输出；无任何输出的失败（根目录不存在、不可读）
+        # 说明扫描结果不可信，直接报错，不能当作空项目缓存
+        for res in (dir_res, file_res):
+            if res.code != 0 and not res.stdout:
+                raise RuntimeError(f"{ctx.name}: 扫描目录失败: {root} (exit {res.code})")
+        dir_out, file_out = dir_res.stdout, file_res.stdout
+
+        offset = len(root) + 1 if root != "/" else 1
+        dirs = sorted(line[offset:] for line in dir_out.splitlines() if len(line) > offset)
+        markers: Dict[str, Set[str]] = {}
+        for line in file_out.splitlines():
+            if len(line) <= offset:
+                continue
+            parent, _, name = line[offset:].rpartition("/")
+            markers.setdefault(parent, set()).add(name)
+        return dirs, markers
+
+    def _scan_directory(
+        self,
+        rel_path: str,
+        structure: ProjectStructure,
+        dirs: List[str],
+        children: Dict[str, List[str]],
+        markers: Dict[str, Set[str]],
+        depth: int = 0,
+    ):
+        """基于 _walk 结果递归处理目录（纯本地计算）"""
+        if depth > SCAN_DEPTH:  # 限制扫描深度
             return
-        
-        for line in result.stdout.strip().splitlines():
-            if not line or line == full_path:
+
+        # 检查是否有项目标记文件
+        files = markers.get(rel_path, set())
+        matched = {MARKER_INDEX[f] for f in files if f in MARKER_INDEX}
+        if matched:
+            # 发现项目组件
+            proj_type = min(matched, key=_TYPE_PRIORITY.__getitem__)
+            component = self._analyze_component(rel_path, proj_type, structure, dirs, files)
+            structure.components.append(component)
+            return  # 找到项目根，不再向下扫描
+
+        prefix = f"{rel_path}/" if rel_path else ""
+        for dir_name in children.get(rel_path, []):
+            if dir_name.startswith("."):
                 continue
-            dir_name = Path(line).name
-            
+            sub_rel = prefix + dir_name
             # 跳过非代码目录
             if self._is_non_code_dir(dir_name):
-                non_code_rel = f"{rel_path}/{dir_name}".lstrip("/")
-                structure.all_non_code_dirs.add(non_code_rel)
+                structure.all_non_code_dirs.add(sub_rel)
                 continue
-            
             # 递归扫描
-            sub_rel = f"{rel_path}/{dir_name}".lstrip("/")
-            self._scan_directory(ctx, sub_rel, structure, depth + 1)
+            self._scan_directory(sub_rel, structure, dirs, children, markers, depth + 1)
 
-    def _analyze_component(self, ctx: EnvContext, rel_path: str, proj_type: str, structure: ProjectStructure) -> Optional[ProjectComponent]:
-        """分析项目组件"""
-        full_path = f"{ctx.entry.path}/{rel_path}".rstrip("/")
-        
+    def _analyze_component(
+        self,
+        rel_path: str,
+        proj_type: str,
+        structure: ProjectStructure,
+        dirs: List[str],
+        files: Set[str],
+    ) -> ProjectComponent:
+        """分析项目组件（files 为组件根目录中的标记文件名）"""
         component = ProjectComponent(
             path=rel_path,
             type=proj_type,
         )
         
         # 查找标记文件
-        for marker in PROJECT_MARKERS.get(proj_type, []):
-            check = ctx.client.run(f"[ -f {full_path}/{marker} ] && echo found")
-            if "found" in check.stdout:
-                component.marker_files.append(marker)
+        component.marker_files = [m for m in PROJECT_MARKERS.get(proj_type, []) if m in files]
         
-        # 扫描子目录，区分代码和非代码
-        result = ctx.client.run(f"find {full_path} -maxdepth 2 -type d 2>/dev/null | head -50")
-        if result.code == 0:
-            for line in result.stdout.strip().splitlines():
-                if not line or line == full_path:
-                    continue
-                dir_name = Path(line).name
-                sub_rel = line.replace(ctx.entry.path, "").lstrip("/")
-                
-                if self._is_non_code_dir(dir_name):
-                    component.non_code_dirs.append(dir_name)
-                    structure.all_non_code_dirs.add(sub_rel)
-                else:
-                    component.code_dirs.append(dir_name)
-                    structure.all_code_dirs.add(sub_rel)
+        # 组件内 COMPONENT_DEPTH 层以内的子目录（最多 50 个），区分代码和非代码
+        prefix = f"{rel_path}/" if rel_path else ""
+        base_depth = rel_path.count("/") + 1 if rel_path else 0
+        sub_dirs = [
+            d for d in dirs
+            if d.startswith(prefix) and d.count("/") + 1 - base_depth <= COMPONENT_DEPTH
+        ][:50]
+        for sub_rel in sub_dirs:
+            dir_name = sub_rel.rpartition("/")[2]
+            if self._is_non_code_dir(dir_name):
+                component.non_code_dirs.append(dir_name)
+                structure.all_non_code_dirs.add(sub_rel)
+            else:
+                component.code_dirs.append(dir_name)
+                structure.all_code_dirs.add(sub_rel)
         
         # 将组件路径加入代码目录
         if rel_path:
@@ -314,29 +415,41 @@ class ProjectScanner:
 
     def _is_non_code_dir(self, name: str) -> bool:
         """判断是否为非代码目录"""
-        if name.startswith("."):
-            return True
-        for pattern in NON_CODE_DIRS:
-            if pattern.startswith("*"):
-                if name.endswith(pattern[1:]):
-                    return True
-            elif name == pattern:
-                return True
-        return False
-
-    def _load_cache(self, env: str) -> Optional[ProjectStructure]:
-        """加载缓存的扫描结果"""
+        return (
+            name.startswith(".")
+            or name in _NON_CODE_LITERALS
+            or _NON_CODE_SUFFIX_RE.search(name) is not None
+        )
+
+    def _cache_key(self, ctx: EnvContext) -> str:
+        """
+        仓库状态键：HEAD 与文件数（已跟踪 + 未忽略的未跟踪文件），一次命令取得。
+        键不变即认为项目结构未变；非 git 仓库返回空字符串
+        """
+        res = ctx.client.run(
+            "git rev-parse HEAD && git ls-files --cached --others --exclude-standard | wc -l",
+            cwd=ctx.entry.path,
+        )
+        if res.code != 0:
+            return ""
+        return hashlib.sha1(" ".join(res.stdout.split()).encode()).hexdigest()
+
+    def _load_cache(self, env: str, cache_key: str) -> Optional[ProjectStructure]:
+        """
+        加载缓存的扫描结果：仓库状态键一致时直接复用（不论缓存时间），
+        非 git 仓库无法判断是否变化，沿用 1 小时过期
+        """
         cache_file = self.cache_dir / f"scan-{env}.json"
-        if not cache_file.exists():
-            return None
-        
         try:
-            import time
-            # 检查缓存是否过期（1小时）
-            if time.time() - cache_file.stat().st_mtime > 3600:
-                return None
-            
-            data = json.loads(cache_file.read_text())
+            data = json.loads(cache_file.read_text(encoding="utf-8"))
+            if cache_key:
+                if data.get("cache_key") != cache_key:
+                    return None
+            else:
+                import time
+                if time.time() - cache_file.stat().st_mtime > 3600:
+                    return None
+
             return ProjectStructure(
                 root_path=data["root_path"],
                 env_name=data["env_name"],
@@ -344,6 +457,8 @@ class ProjectScanner:
                 all_code_dirs=set(data["all_code_dirs"]),
                 all_non_code_dirs=set(data["all_non_code_dirs"]),
                 scan_time=data.get("scan_time", ""),
+                digest=data.get("digest", ""),
+                cache_key=data.get("cache_key", ""),
             )
         except Exception:
             return None
@@ -351,4 +466,7 @@ class ProjectScanner:
     def _save_cache(self, env: str, structure: ProjectStructure):
         """保存扫描结果到缓存"""
         cache_file = self.cache_dir / f"scan-{env}.json"
-        cache_file.write_text(json.dumps(structure.to_dict(), indent=2, ensure_ascii=False))
+        cache_file.write_text(
+            json.dumps(structure.to_dict(), separators=(",", ":"), ensure_ascii=False),
+            encoding="utf-8",
+        )
@@ -1,11 +1,11 @@
 from __future__ import annotations
 
-import subprocess
-from typing import Literal, Optional
+from collections import deque
+from typing import Dict, Literal, Optional
 
 from envsync.core.config import ConfigData
-from envsync.core.rsync_config import build_rsync_args
-from envsync.utils.envs import EnvContext
+from envsync.core.rsync_config import RsyncStream, build_rsync_args, gitignore_filter_for, should_compress
+from envsync.utils.envs import EnvContext, context_for
 from envsync.utils.git import GitRepo
 from envsync.utils.logger import get_logger
 
@@ -21,6 +21,7 @@ class SyncService:
 
     def __init__(self, config: ConfigData):
         self.config = config
+        self._ctx_cache: Dict[str, EnvContext] = {}
 
     def sync(self, source: str, target: str, strategy: Literal["safe", "force"] = "safe"):
         ctx_src, ctx_dst = self._ctx(source), self._ctx(target)
@@ -31,9 +32,7 @@ class SyncService:
         log.info("同步完成: %s -> %s", ctx_src.display, ctx_dst.display)
 
     def _ctx(self, env: str) -> EnvContext:
-        if env not in self.config.envs:
-            raise ValueError(f"环境未配置: {env}")
-        return EnvContext(name=env, entry=self.config.envs[env])
+        return context_for(self._ctx_cache, self.config.envs, env)
 
     def _ensure_clean_target(self, ctx: EnvContext):
         repo = self._git_repo(ctx)
@@ -60,9 +59,24 @@ class SyncService:
             delete=True,
             progress=True,
             itemize=True,
+            compress=should_compress(src.is_remote or dst.is_remote),
+            merged_filter=gitignore_filter_for(src.entry.path, src.is_local),
+            fast_checksum=src.is_local and dst.is_local,
         )
         args.extend([src.rsync_spec(), dst.rsync_spec()])
-        proc = subprocess.run(args, capture_output=True, text=True)
-        if proc.returncode not in (0, 23):
-            raise RuntimeError(f"rsync 失败: {proc.stderr or proc.stdout}")
-        log.info(proc.stdout.strip() or "rsync 完成")
+        # 边传输边输出，只保留最后若干行用于失败时的错误信息
+        tail: deque = deque(maxlen=200)
+        with RsyncStream(args) as stream:
+            for line in stream.lines():
+                if not line.strip():
+                    continue
+                tail.append(line)
+                if line[0].isspace():
+                    log.debug(line.strip())  # --info=progress2 的进度行
+                else:
+                    log.info(line)
+            code = stream.wait()
+            if code not in (0, 23):
+                detail = stream.stderr() or "\n".join(tail)
+                raise RuntimeError(f"rsync 失败: {detail}")
+        log.info("rsync 完成")
@@ -5,7 +5,7 @@ import os
 from pathlib import Path
 from typing import Optional
 
-from cryptography.fernet import Fernet
+from cryptography.fernet import Fernet, InvalidToken
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 
@@ -21,16 +21,36 @@ class SecretManager:
     """
     管理敏感信息的加密与解密。
     使用机器特定的密钥（基于用户目录和主机名）+ PBKDF2 生成加密密钥。
+    密钥与 Fernet 实例在首次使用后缓存，密钥文件变更后需调用 reload()。
     """
 
     def __init__(self, key_dir: Optional[Path] = None):
         self.key_dir = key_dir or (Path.home() / ".envsync")
         self.key_file = self.key_dir / ".secret_key"
+        self._key: Optional[bytes] = None
+        self._fernet: Optional[Fernet] = None
+
+    def reload(self) -> None:
+        """丢弃缓存的密钥，下次加解密时重新读取密钥文件"""
+        self._key = None
+        self._fernet = None
 
     def _get_or_create_key(self) -> bytes:
         """获取或创建加密密钥"""
-        if self.key_file.exists():
+        if self._key is None:
+            self._key = self._load_or_create_key()
+        return self._key
+
+    def _get_fernet(self) -> Fernet:
+        if self._fernet is None:
+            self._fernet = Fernet(self._get_or_create_key())
+        return self._fernet
+
+    def _load_or_create_key(self) -> bytes:
+        try:
             return self.key_file.read_bytes()
+        except FileNotFoundError:
+            pass
 
         # 生成基于机器和用户的唯一 salt
         import socket
@@ -59,10 +79,8 @@ class SecretManager:
         """加密明文，返回带前缀标记的密文"""
         if not plaintext:
             return ""
-        key = self._get_or_create_key()
-        f = Fernet(key)
-        encrypted = f.encrypt(plaintext.encode())
-        return ENCRYPTED_PREFIX + base64.urlsafe_b64encode(encrypted).decode()
+        # Fernet token 本身已是 URL-safe base64，直接拼接前缀
+        return ENCRYPTED_PREFIX + self._get_fernet().encrypt(plaintext.encode()).decode()
 
     def decrypt(self, ciphertext: str) -> str:
         """解密密文，自动处理前缀标记"""
@@ -72,26 +90,33 @@ class SecretManager:
             # 移除前缀标记
             if ciphertext.startswith(ENCRYPTED_PREFIX):
                 ciphertext = ciphertext[len(ENCRYPTED_PREFIX):]
-            key = self._get_or_create_key()
-            f = Fernet(key)
-            encrypted = base64.urlsafe_b64decode(ciphertext.encode())
-            decrypted = f.decrypt(encrypted)
-            return decrypted.decode()
+            f = self._get_fernet()
+            token = ciphertext.encode()
+            try:
+                return f.decrypt(token).decode()
+            except InvalidToken:
+                # 兼容旧格式：Fernet token 外层又做了一次 base64 编码
+                return f.decrypt(base64.urlsafe_b64decode(token)).decode()
         except Exception as e:
             raise RuntimeError(f"解密失败，密钥可能已变更或数据损坏: {e}")
 
     def is_encrypted(self, text: str) -> bool:
         """判断文本是否已加密（通过前缀标记识别）"""
-        if not text:
+        return bool(text) and text.startswith(ENCRYPTED_PREFIX)
+
+    def is_encrypted_legacy(self, text: str) -> bool:
+        """
+        启发式识别旧版本无前缀标记的密文，仅供兼容旧配置使用；
+        需要 base64 解码，新格式请用 is_encrypted
+        """
+        if not text or text.startswith(ENCRYPTED_PREFIX):
+            return False
+        if len(text) <= 50 or "=" not in text[-4:]:
             return False
-        # 新版本：通过前缀标记识别
-        if text.startswith(ENCRYPTED_PREFIX):
-            return True
-        # 兼容旧版本：启发式检测
         if text.startswith("<") or "://" in text[:10]:
             return False
         try:
             base64.urlsafe_b64decode(text.encode())
-            return len(text) > 50 and "=" in text[-4:]
+            return True
         except Exception:
             return False
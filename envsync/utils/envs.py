@@ -1,14 +1,54 @@
 from __future__ import annotations
 
+import atexit
+import threading
 from dataclasses import dataclass, field
-from typing import Optional
+from typing import Dict, List, Optional, Tuple
 
 from envsync.core.config import EnvEntry
 from envsync.utils.ssh import SSHClientWrapper
 
+# 进程内按 (host, user) 共享客户端，同一主机的多个 EnvContext 复用一条 SSH 连接。
+# 值为 [客户端, 引用计数]，均在 _CLIENTS_LOCK 下读写
+_CLIENTS: Dict[Tuple[Optional[str], Optional[str]], List] = {}
+_CLIENTS_LOCK = threading.Lock()
+
+
+def _acquire_client(host: Optional[str], user: Optional[str]) -> SSHClientWrapper:
+    """取得共享客户端并增加引用计数（调用方需持有 _CLIENTS_LOCK）"""
+    slot = _CLIENTS.get((host, user))
+    if slot is None:
+        slot = _CLIENTS[(host, user)] = [SSHClientWrapper(host=host, user=user), 0]
+    slot[1] += 1
+    return slot[0]
+
+
+def _release_client(host: Optional[str], user: Optional[str], client: SSHClientWrapper):
+    """减少引用计数，最后一个引用释放时关闭连接（调用方需持有 _CLIENTS_LOCK）"""
+    slot = _CLIENTS.get((host, user))
+    if slot is None or slot[0] is not client:
+        return
+    slot[1] -= 1
+    if slot[1] <= 0:
+        del _CLIENTS[(host, user)]
+        client.close()
+
+
+@atexit.register
+def _close_clients():
+    with _CLIENTS_LOCK:
+        for client, _ in _CLIENTS.values():
+            client.close()
+        _CLIENTS.clear()
+
 
 @dataclass
 class EnvContext:
+    """
+    环境运行上下文。client 取自进程级共享表（加锁创建），多线程并发访问时同一主机只会有一个客户端。
+    共享客户端按引用计数管理：close()（或退出 with 块）只释放本上下文的引用，
+    仍被其他上下文使用的连接不受影响，最后一个引用释放时才关闭；未显式释放的由进程退出时统一关闭
+    """
     name: str
     entry: EnvEntry
     _client: Optional[SSHClientWrapper] = field(default=None, repr=False, compare=False)
@@ -17,12 +57,33 @@ class EnvContext:
     def is_remote(self) -> bool:
         return self.entry.host not in (None, "", "localhost", "127.0.0.1")
 
+    @property
+    def is_local(self) -> bool:
+        return not self.is_remote
+
+    def __enter__(self) -> "EnvContext":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
     @property
     def client(self) -> SSHClientWrapper:
-        """惰性创建并复用 SSH 客户端"""
-        if self._client is None:
-            object.__setattr__(self, '_client', SSHClientWrapper(host=self.entry.host, user=self.entry.user))
-        return self._client
+        """惰性获取共享 SSH 客户端，同一上下文只持有一个引用"""
+        client = self._client
+        if client is None:
+            with _CLIENTS_LOCK:
+                if self._client is None:
+                    self._client = _acquire_client(self.entry.host, self.entry.user)
+                client = self._client
+        return client
+
+    def close(self):
+        """释放本上下文对共享客户端的引用，未使用过 client 时不做任何事"""
+        with _CLIENTS_LOCK:
+            if self._client is not None:
+                _release_client(self.entry.host, self.entry.user, self._client)
+                self._client = None
 
     @property
     def display(self) -> str:
@@ -40,3 +101,16 @@ class EnvContext:
             user = f"{self.entry.user}@" if self.entry.user else ""
             return f"{user}{self.entry.host}:{path}"
         return path
+
+
+def context_for(cache: Dict[str, EnvContext], envs: Dict[str, EnvEntry], env: str) -> EnvContext:
+    """
+    按环境名取得 EnvContext 并缓存到 cache（各服务实例各持一份），
+    同一服务内对同一环境的多次调用复用同一上下文；环境未配置时抛出 ValueError
+    """
+    ctx = cache.get(env)
+    if ctx is None:
+        if env not in envs:
+            raise ValueError(f"环境未配置: {env}")
+        ctx = cache[env] = EnvContext(name=env, entry=envs[env])
+    return ctx
@@ -2,7 +2,7 @@ from __future__ import annotations
 
 import shlex
 from dataclasses import dataclass
-from typing import List, Optional, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 
 from envsync.utils.envs import EnvContext
 from envsync.utils.ssh import CommandResult
@@ -30,74 +30,180 @@ class GitStatus:
         return lines
 
 
+@dataclass
+class GitSnapshot:
+    """单次 git status 调用得到的工作区快照"""
+    head: Optional[str]  # 尚无提交时为 None
+    branch: str
+    dirty: bool
+    short_status: List[str]
+
+
+def _parse_porcelain_v2(output: str) -> Tuple[Dict[str, str], List[str]]:
+    """
+    解析 `git status --porcelain=v2 --branch` 输出，
+    返回 ({头部字段: 值}, 与 --porcelain v1 相同格式的变更行)
+    """
+    headers: Dict[str, str] = {}
+    entries: List[str] = []
+    for ln in output.splitlines():
+        if ln.startswith("# "):
+            key, _, value = ln[2:].partition(" ")
+            headers[key] = value
+        elif ln.startswith("? "):
+            entries.append(f"?? {ln[2:]}")
+        elif ln[:2] in ("1 ", "u "):
+            fields = ln.split(" ", 10 if ln[0] == "u" else 8)
+            entries.append(f"{fields[1].replace('.', ' ')} {fields[-1]}")
+        elif ln.startswith("2 "):
+            fields = ln.split(" ", 9)
+            path, _, orig = fields[-1].partition("\t")
+            entries.append(f"{fields[1].replace('.', ' ')} {orig} -> {path}")
+    return headers, entries
+
+
 class GitRepo:
     """
     通过 EnvContext 在本地或远程执行 git 命令。
+    只读查询（HEAD、分支、status）结果在实例内缓存，变更类操作后自动失效。
     """
 
     def __init__(self, ctx: EnvContext):
         self.ctx = ctx
         self.client = ctx.client
         self.path = ctx.entry.path
+        self._cache: Dict[str, Any] = {}
+
+    def invalidate(self):
+        """清除缓存的查询结果，工作区或 HEAD 可能被外部修改后调用"""
+        self._cache.clear()
 
     def _git(self, args: str) -> CommandResult:
         cmd = f"git -C {shlex.quote(self.path)} {args}"
         return self.client.run(cmd)
 
     def ensure_repo(self):
+        if self._cache.get("is_repo"):
+            return
         res = self._git("rev-parse --is-inside-work-tree")
         if res.code != 0 or "true" not in res.stdout:
             raise RuntimeError(f"{self.ctx.name}: 路径不是 git 仓库: {self.path}")
+        self._cache["is_repo"] = True
 
     def fetch(self):
         self._git("fetch --all --prune")
+        self.invalidate()
 
     def current_branch(self) -> str:
-        res = self._git("rev-parse --abbrev-ref HEAD")
-        res.check_ok(f"{self.ctx.name} 获取分支")
-        return res.stdout.strip()
+        if "branch" not in self._cache:
+            res = self._git("rev-parse --abbrev-ref HEAD")
+            res.check_ok(f"{self.ctx.name} 获取分支")
+            self._cache["branch"] = res.stdout.strip()
+        return self._cache["branch"]
 
     def head_commit(self) -> str:
-        res = self._git("rev-parse HEAD")
+        if "head" not in self._cache:
+            res = self._git("rev-parse HEAD")
+            res.check_ok(f"{self.ctx.name} 获取 HEAD")
+            self._cache["head"] = res.stdout.strip()
+        return self._cache["head"]
+
+    def head_and_branch(self) -> Tuple[str, str]:
+        """单次 git 调用获取 (HEAD commit, 当前分支)，总是重新查询"""
+        res = self._git("rev-parse HEAD --abbrev-ref HEAD")
         res.check_ok(f"{self.ctx.name} 获取 HEAD")
-        return res.stdout.strip()
+        head, branch = res.stdout.split()[:2]
+        self._cache["head"] = head
+        self._cache["branch"] = branch
+        return head, branch
 
-    def upstream(self) -> Optional[str]:
-        res = self._git("rev-parse --abbrev-ref --symbolic-full-name @{u}")
+    def _porcelain_v2(self) -> Tuple[Dict[str, str], List[str]]:
+        """执行并缓存 `git status --porcelain=v2 --branch`，供 snapshot() 与 status() 共用"""
+        cached = self._cache.get("porcelain_v2")
+        if cached is not None:
+            return cached
+        res = self._git("status --porcelain=v2 --branch")
         if res.code != 0:
-            return None
-        return res.stdout.strip()
+            raise RuntimeError(f"{self.ctx.name}: 路径不是 git 仓库: {self.path}")
+        cached = self._cache["porcelain_v2"] = _parse_porcelain_v2(res.stdout)
+        self._cache["is_repo"] = True
+        return cached
+
+    def snapshot(self) -> GitSnapshot:
+        """
+        一次 git 调用同时完成仓库检查并取得 HEAD、分支与工作区变更，
+        结果缓存并回填 head/branch 缓存
+        """
+        cached = self._cache.get("snapshot")
+        if cached is not None:
+            return cached
+        headers, entries = self._porcelain_v2()
+        oid = headers.get("branch.oid", "(initial)")
+        snap = GitSnapshot(
+            head=None if oid == "(initial)" else oid,
+            branch=headers.get("branch.head", ""),
+            dirty=bool(entries),
+            short_status=entries,
+        )
+        if snap.head:
+            self._cache["head"] = snap.head
+        self._cache["snapshot"] = snap
+        return snap
+
+    def upstream(self) -> Optional[str]:
+        if "upstream" not in self._cache:
+            res = self._git("rev-parse --abbrev-ref --symbolic-full-name @{u}")
+            self._cache["upstream"] = res.stdout.strip() if res.code == 0 else None
+        return self._cache["upstream"]
 
     def ahead_behind(self) -> Tuple[int, int]:
         """
         返回 (ahead, behind)
         """
-        up = self.upstream()
-        if not up:
-            return 0, 0
-        res = self._git("rev-list --left-right --count HEAD...@{u}")
-        if res.code != 0:
-            return 0, 0
-        left, right = res.stdout.strip().split()
-        # left = HEAD only, right = upstream only
-        return int(left), int(right)
+        if "ahead_behind" in self._cache:
+            return self._cache["ahead_behind"]
+        counts = (0, 0)
+        if self.upstream():
+            res = self._git("rev-list --left-right --count HEAD...@{u}")
+            if res.code == 0:
+                left, right = res.stdout.strip().split()
+                # left = HEAD only, right = upstream only
+                counts = (int(left), int(right))
+        self._cache["ahead_behind"] = counts
+        return counts
 
     def status(self) -> GitStatus:
-        self.ensure_repo()
-        branch = self.current_branch()
-        head = self.head_commit()
-        upstream = self.upstream()
-        ahead, behind = self.ahead_behind()
-
-        res = self._git("status --porcelain")
-        res.check_ok(f"{self.ctx.name} status")
-        lines = [ln for ln in res.stdout.splitlines() if ln]
+        """
+        单次 `git status --porcelain=v2 --branch` 取得分支、HEAD、上游、ahead/behind 与工作区变更
+        """
+        cached = self._cache.get("status")
+        if cached is not None:
+            return cached
+        headers, lines = self._porcelain_v2()
+        branch = headers.get("branch.head", "")
+        if branch == "(detached)":
+            branch = "HEAD"  # 与 rev-parse --abbrev-ref HEAD 的输出保持一致
+        head = headers.get("branch.oid", "(initial)")
+        # 上游已配置但远端分支不存在时没有 branch.ab，视为无上游
+        ab = headers.get("branch.ab")
+        upstream = headers.get("branch.upstream") if ab else None
+        ahead = behind = 0
+        if ab:
+            plus, minus = ab.split()
+            ahead, behind = int(plus), -int(minus)
+        # 回填单项查询的缓存，后续 current_branch()/upstream() 等不再调用 git
+        self._cache.setdefault("branch", branch)
+        self._cache.setdefault("upstream", upstream)
+        self._cache.setdefault("ahead_behind", (ahead, behind))
+        if head != "(initial)":
+            self._cache.setdefault("head", head)
+
         staged = sum(1 for ln in lines if ln[0] != " " and ln[0] != "?")
         changed = sum(1 for ln in lines if ln[0] == " " and ln[1] != "?")
         untracked = sum(1 for ln in lines if ln.startswith("??"))
         dirty = bool(lines)
 
-        return GitStatus(
+        st = GitStatus(
             branch=branch,
             head=head,
             upstream=upstream,
@@ -109,8 +215,11 @@ class GitRepo:
             untracked=untracked,
             short_status=lines,
         )
+        self._cache["status"] = st
+        return st
 
     def checkout_branch(self, branch: str):
+        self.invalidate()
         res = self._git(f"rev-parse --verify {shlex.quote(branch)}")
         if res.code == 0:
             self._git(f"checkout {shlex.quote(branch)}").check_ok(f"{self.ctx.name} checkout {branch}")
@@ -128,6 +237,7 @@ class GitRepo:
         args = f"pull"
         if branch:
             args = f"pull origin {shlex.quote(branch)}"
+        self.invalidate()
         self._git(args).check_ok(f"{self.ctx.name} pull")
 
     def push(self, branch: Optional[str] = None, set_upstream: bool = True):
@@ -137,18 +247,38 @@ class GitRepo:
                 args = f"push -u origin {shlex.quote(branch)}"
             else:
                 args = f"push origin {shlex.quote(branch)}"
+        self.invalidate()
         self._git(args).check_ok(f"{self.ctx.name} push")
 
     def reset_hard(self, ref: str):
+        self.invalidate()
         self._git(f"reset --hard {shlex.quote(ref)}").check_ok(f"{self.ctx.name} reset --hard {ref}")
 
     def clean(self):
+        self.invalidate()
         self._git("clean -fd").check_ok(f"{self.ctx.name} clean -fd")
 
     def has_commit(self, commit: str) -> bool:
         res = self._git(f"cat-file -e {shlex.quote(commit)}^{{commit}}")
         return res.code == 0
 
+    def has_commits(self, commits: List[str]) -> Dict[str, bool]:
+        """
+        批量检查提交是否存在：所有引用经 stdin 交给一次 `git cat-file --batch-check`，
+        远程时也只需一次 SSH 往返
+        """
+        if not commits:
+            return {}
+        refs = " ".join(shlex.quote(f"{c}^{{commit}}") for c in commits)
+        cmd = f"printf '%s\\n' {refs} | git -C {shlex.quote(self.path)} cat-file --batch-check"
+        res = self.client.run(cmd)
+        lines = res.stdout.splitlines()
+        if res.code != 0 or len(lines) != len(commits):
+            # 批量模式不可用时逐个检查
+            return {c: self.has_commit(c) for c in commits}
+        # 输出与输入逐行对应：存在时为 "<sha> commit <size>"，否则为 "<ref> missing" 等
+        return {c: ln.split(" ")[1:2] == ["commit"] for c, ln in zip(commits, lines)}
+
     def diff_name_status(self, base: str, target: str) -> List[str]:
         res = self._git(f"diff --name-status {shlex.quote(base)}..{shlex.quote(target)}")
         if res.code != 0:
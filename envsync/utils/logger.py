@@ -4,15 +4,16 @@ from typing import Optional
 from rich.console import Console
 from rich.logging import RichHandler
 
+# 所有 logger 共用一个 Console/RichHandler，避免每个模块重复探测终端能力
+_SHARED_CONSOLE = Console()
+_SHARED_HANDLER = RichHandler(console=_SHARED_CONSOLE, rich_tracebacks=True, show_time=False)
+_SHARED_HANDLER.setFormatter(logging.Formatter("%(levelname)s: %(message)s"))
+
 
 def get_logger(name: Optional[str] = None) -> logging.Logger:
     logger = logging.getLogger(name)
     if not logger.handlers:
-        console = Console()
-        handler = RichHandler(console=console, rich_tracebacks=True, show_time=False)
-        formatter = logging.Formatter("%(levelname)s: %(message)s")
-        handler.setFormatter(formatter)
-        logger.addHandler(handler)
+        logger.addHandler(_SHARED_HANDLER)
         logger.setLevel(logging.INFO)
         logger.propagate = False
     return logger
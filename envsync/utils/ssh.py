@@ -1,12 +1,52 @@
 from __future__ import annotations
 
+import functools
+import os
+import re
 import shlex
+import shutil
+import stat
 import subprocess
+import threading
 from dataclasses import dataclass
-from typing import Dict, Optional
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Union
 
 import paramiko
 
+# 复用连接的 keepalive 间隔（秒）
+SSH_KEEPALIVE_INTERVAL = 30
+
+# OpenSSH 连接复用：同一主机的多次 ssh/rsync 共享控制连接，空闲 60 秒后关闭。
+# %C 为连接参数的哈希，避免 socket 路径超长
+SSH_CONTROL_OPTS = (
+    "-o", "ControlMaster=auto",
+    "-o", "ControlPath=~/.envsync/cm/%C",
+    "-o", "ControlPersist=60s",
+)
+
+# ssh 自身失败（而非远程命令失败）时退出码为 255。只认 ssh 自己的诊断行（以 "ssh: " 开头，
+# 如解析失败、连接被拒绝/超时），远程命令输出的同类文字不会被误判
+_SSH_FAILURE_RE = re.compile(r"^ssh: ", re.MULTILINE)
+
+
+@functools.lru_cache(maxsize=1)
+def _system_host_keys() -> paramiko.HostKeys:
+    """进程内只读取并解析一次 ~/.ssh/known_hosts（与 load_system_host_keys 相同，文件不可读时为空）"""
+    keys = paramiko.HostKeys()
+    try:
+        keys.load(os.path.expanduser("~/.ssh/known_hosts"))
+    except IOError:
+        pass
+    return keys
+
+
+def ensure_ssh_control_dir() -> Path:
+    """确保 SSH 控制 socket 目录存在（ssh 不会自动创建）"""
+    path = Path.home() / ".envsync" / "cm"
+    path.mkdir(mode=0o700, parents=True, exist_ok=True)
+    return path
+
 
 @dataclass
 class CommandResult:
@@ -25,6 +65,9 @@ class SSHClientWrapper:
     """
     简化本地/远程命令执行。host 为 None/localhost 时走本地子进程，否则走 SSH。
     使用系统 known_hosts 验证主机密钥以提高安全性。
+    远程命令优先调用系统 ssh 并复用 ControlMaster 连接；找不到 ssh 时回退到 paramiko，
+    paramiko 连接在首次使用时建立并复用，后续命令仅新开 channel。
+    可作为上下文管理器使用，退出时关闭连接。
     """
 
     def __init__(self, host: Optional[str], user: Optional[str] = None, port: int = 22, timeout: int = 600):
@@ -32,13 +75,67 @@ class SSHClientWrapper:
         self.user = user
         self.port = port
         self.timeout = timeout
+        self._client: Optional[paramiko.SSHClient] = None
+        self._sftp: Optional[paramiko.SFTPClient] = None
+        self._lock = threading.Lock()
+        self._ssh_bin = shutil.which("ssh")
+
+    def __enter__(self) -> "SSHClientWrapper":
+        return self
 
-    def run(self, command: str, cwd: Optional[str] = None, env: Optional[Dict[str, str]] = None) -> CommandResult:
-        if self.host in (None, "", "localhost", "127.0.0.1"):
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def is_local(self) -> bool:
+        return self.host in (None, "", "localhost", "127.0.0.1")
+
+    def run(
+        self,
+        command: Union[str, Sequence[str]],
+        cwd: Optional[str] = None,
+        env: Optional[Dict[str, str]] = None,
+    ) -> CommandResult:
+        """
+        执行命令。command 为字符串时经 shell 解释；为参数列表时本地直接 exec（不启动 shell），
+        远程逐个参数转义后拼接，参数内容不会被 shell 解释
+        """
+        if self.is_local:
             return self._run_local(command, cwd=cwd, env=env)
         return self._run_remote(command, cwd=cwd, env=env)
 
-    def _run_local(self, command: str, cwd: Optional[str], env: Optional[Dict[str, str]]) -> CommandResult:
+    def isfile(self, path: str) -> bool:
+        """
+        判断路径是否为普通文件：本地直接 stat；远程默认经系统 ssh 在远端登录 shell 中执行 `test -f`
+        （路径已转义），找不到 ssh 时退回 paramiko SFTP stat，不经过 shell
+        """
+        if self.is_local:
+            return os.path.isfile(path)
+        if self._ssh_bin:
+            return self._run_remote(["test", "-f", path], cwd=None, env=None).code == 0
+        try:
+            attrs = self._sftp_client().stat(path)
+        except IOError:
+            return False
+        return attrs.st_mode is not None and stat.S_ISREG(attrs.st_mode)
+
+    def _sftp_client(self) -> paramiko.SFTPClient:
+        client = self._connect()
+        with self._lock:
+            if self._sftp is None:
+                self._sftp = client.open_sftp()
+            return self._sftp
+
+    def _run_local(
+        self, command: Union[str, Sequence[str]], cwd: Optional[str], env: Optional[Dict[str, str]]
+    ) -> CommandResult:
+        if not isinstance(command, str):
+            try:
+                proc = subprocess.run(list(command), cwd=cwd, capture_output=True, text=True, env=env)
+            except OSError as e:
+                # 与 shell 行为保持一致：命令或工作目录不存在时返回非零退出码而不是抛出异常
+                return CommandResult(code=127, stdout="", stderr=str(e))
+            return CommandResult(code=proc.returncode, stdout=proc.stdout, stderr=proc.stderr)
         full_cmd = command
         if cwd:
             full_cmd = f"cd {shlex.quote(cwd)} && {command}"
@@ -51,45 +148,116 @@ class SSHClientWrapper:
         )
         return CommandResult(code=proc.returncode, stdout=proc.stdout, stderr=proc.stderr)
 
-    def _run_remote(self, command: str, cwd: Optional[str], env: Optional[Dict[str, str]]) -> CommandResult:
-        client = paramiko.SSHClient()
-        # 优先使用系统 known_hosts，提高安全性
-        client.load_system_host_keys()
-        # 仅在开发环境允许自动添加新主机（可通过环境变量控制）
-        import os
+    def _connect(self) -> paramiko.SSHClient:
+        """返回已连接的 SSHClient，连接断开时重建"""
+        with self._lock:
+            if self._client is not None:
+                transport = self._client.get_transport()
+                if transport is not None and transport.is_active():
+                    return self._client
+                self._client.close()
+                self._client = None
+                self._sftp = None
+
+            client = paramiko.SSHClient()
+            # 优先使用系统 known_hosts，提高安全性。系统密钥只读（新主机由 AutoAddPolicy 写入 _host_keys），
+            # 可在各连接间共享已解析的实例
+            client._system_host_keys = _system_host_keys()
+            # 仅在开发环境允许自动添加新主机（可通过环境变量控制）
+            if os.environ.get("ENVSYNC_AUTO_ADD_HOST", "").lower() == "true":
+                client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+            else:
+                client.set_missing_host_key_policy(paramiko.RejectPolicy())
+
+            try:
+                client.connect(
+                    hostname=self.host,
+                    username=self.user,
+                    port=self.port,
+                    allow_agent=True,
+                    look_for_keys=True,
+                    timeout=self.timeout,
+                )
+            except paramiko.SSHException as e:
+                if "not found in known_hosts" in str(e).lower():
+                    raise RuntimeError(
+                        f"主机 {self.host} 不在 known_hosts 中。"
+                        f"请先手动 SSH 连接添加主机密钥，或设置环境变量 ENVSYNC_AUTO_ADD_HOST=true"
+                    ) from e
+                raise
+            # 定期发送 keepalive，避免空闲期间连接被中间设备断开后需要重新认证
+            transport = client.get_transport()
+            if transport is not None:
+                transport.set_keepalive(SSH_KEEPALIVE_INTERVAL)
+            self._client = client
+            return client
+
+    def close(self):
+        """关闭复用的 SSH 连接"""
+        with self._lock:
+            if self._sftp is not None:
+                self._sftp.close()
+                self._sftp = None
+            if self._client is not None:
+                self._client.close()
+                self._client = None
+
+    def _run_remote(
+        self, command: Union[str, Sequence[str]], cwd: Optional[str], env: Optional[Dict[str, str]]
+    ) -> CommandResult:
+        if not isinstance(command, str):
+            command = " ".join(shlex.quote(arg) for arg in command)
+        env_prefix = ""
+        if env:
+            merged = " ".join(f"{k}={shlex.quote(v)}" for k, v in env.items())
+            env_prefix = f"export {merged} && "
+        cmd = command
+        if cwd:
+            cmd = f"cd {shlex.quote(cwd)} && {command}"
+        if self._ssh_bin:
+            return self._run_openssh(env_prefix + cmd)
+        client = self._connect()
+        stdin, stdout, stderr = client.exec_command(env_prefix + cmd, timeout=self.timeout)
+        out = stdout.read().decode()
+        err = stderr.read().decode()
+        exit_status = stdout.channel.recv_exit_status()
+        return CommandResult(code=exit_status, stdout=out, stderr=err)
+
+    def _ssh_argv(self, remote_cmd: str) -> List[str]:
+        ensure_ssh_control_dir()
+        argv = [self._ssh_bin, *SSH_CONTROL_OPTS, "-o", "BatchMode=yes", "-p", str(self.port)]
         if os.environ.get("ENVSYNC_AUTO_ADD_HOST", "").lower() == "true":
-            client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+            argv.extend(["-o", "StrictHostKeyChecking=accept-new"])
         else:
-            client.set_missing_host_key_policy(paramiko.RejectPolicy())
-        
+            argv.extend(["-o", "StrictHostKeyChecking=yes"])
+        argv.extend([self._ssh_target, remote_cmd])
+        return argv
+
+    @property
+    def _ssh_target(self) -> str:
+        return f"{self.user}@{self.host}" if self.user else self.host
+
+    def _run_openssh(self, remote_cmd: str) -> CommandResult:
+        """通过系统 ssh 执行远程命令，首次连接建立控制 socket，后续命令跳过密钥交换与认证"""
         try:
-            client.connect(
-                hostname=self.host,
-                username=self.user,
-                port=self.port,
-                allow_agent=True,
-                look_for_keys=True,
+            proc = subprocess.run(
+                self._ssh_argv(remote_cmd),
+                capture_output=True,
+                text=True,
                 timeout=self.timeout,
             )
-        except paramiko.SSHException as e:
-            if "not found in known_hosts" in str(e).lower():
+        except subprocess.TimeoutExpired as e:
+            raise RuntimeError(f"远程命令超时 ({self.timeout}s): {self.host}") from e
+        if proc.returncode == 255:
+            if re.search(r"^Host key verification failed", proc.stderr, re.MULTILINE):
                 raise RuntimeError(
                     f"主机 {self.host} 不在 known_hosts 中。"
                     f"请先手动 SSH 连接添加主机密钥，或设置环境变量 ENVSYNC_AUTO_ADD_HOST=true"
-                ) from e
-            raise
-        try:
-            env_prefix = ""
-            if env:
-                merged = " ".join(f"{k}={shlex.quote(v)}" for k, v in env.items())
-                env_prefix = f"export {merged} && "
-            cmd = command
-            if cwd:
-                cmd = f"cd {shlex.quote(cwd)} && {command}"
-            stdin, stdout, stderr = client.exec_command(env_prefix + cmd, timeout=self.timeout)
-            out = stdout.read().decode()
-            err = stderr.read().decode()
-            exit_status = stdout.channel.recv_exit_status()
-            return CommandResult(code=exit_status, stdout=out, stderr=err)
-        finally:
-            client.close()
+                )
+            # 认证失败的诊断行以目标 "user@host: " 开头而不是 "ssh: "
+            if _SSH_FAILURE_RE.search(proc.stderr) or re.search(
+                rf"^{re.escape(self._ssh_target)}: Permission denied \(", proc.stderr, re.MULTILINE
+            ):
+                # 与 paramiko 路径一致：连接或认证失败时抛出异常，而不是当作远程命令的输出返回
+                raise RuntimeError(f"SSH 连接 {self.host} 失败: {proc.stderr.strip()}")
+        return CommandResult(code=proc.returncode, stdout=proc.stdout, stderr=proc.stderr)